@@ -0,0 +1,81 @@
+from __future__ import annotations
+from fractions import Fraction
+from functools import reduce
+from typing import Callable
+from egraph import *
+
+# Literals are nullary nodes whose operator is a number, like
+# `Term("42", ())` or `Term("1/2", ())`. Arithmetic is exact so that
+# folding never changes what a term means.
+
+def literal_value(f: str) -> Fraction | None:
+    """
+    The value of the literal operator `f`, or `None` if `f` isn't a
+    number.
+    """
+    try:
+        return Fraction(f)
+    except ValueError:
+        return None
+
+def literal_operator(c: Fraction) -> str:
+    """
+    The operator of the literal node for `c`. Inverse of
+    `literal_value`.
+    """
+    return str(c)
+
+def divide(x: Fraction, y: Fraction) -> Fraction | None:
+    return x / y if y != 0 else None
+
+def reciprocal(x: Fraction) -> Fraction | None:
+    return 1 / x if x != 0 else None
+
+# How to evaluate each operator on constant operands, by arity. A
+# result of `None` means the operation is undefined, and the e-class
+# just doesn't get a constant.
+folds: dict[tuple[str, int], Callable[..., Fraction | None]] = {
+    ("+", 2): lambda x, y: x + y,
+    ("-", 2): lambda x, y: x - y,
+    ("*", 2): lambda x, y: x * y,
+    ("/", 2): divide,
+    ("negate", 1): lambda x: -x,
+    ("^-1", 1): reciprocal,
+}
+
+class ConstantFolding(Analysis):
+    """
+    Tracks the constant value of each e-class, if it has one. An
+    e-class with a value gets the literal node for it, and every other
+    node is pruned: once we know a class is 3, `1 + 2` and `6 / 2`
+    only give e-matching more to do.
+    """
+    def make(self, egraph: EGraph, n: ENode) -> Fraction | None:
+        if not n.operands:
+            return literal_value(n.operator)
+        fold = folds.get((n.operator, len(n.operands)))
+        if fold is None and n.operator in egraph.ac and (n.operator, 2) in folds:
+            # A flattened AC node folds one operand at a time
+            fold = lambda *xs, f=folds[(n.operator, 2)]: reduce(f, xs)
+        if fold is None:
+            return None
+        xs = [egraph.classes[egraph.find(b)].data for b in n.operands]
+        if any(x is None for x in xs):
+            return None
+        return fold(*xs)
+
+    def merge(self, x: Fraction | None, y: Fraction | None) -> Fraction | None:
+        if x is None:
+            return y
+        if y is not None and x != y:
+            raise ValueError(f"e-class is equal to both {x} and {y}")
+        return x
+
+    def modify(self, egraph: EGraph, a: EClassId):
+        c = egraph.classes[a].data
+        if c is None:
+            return
+        egraph.union(a, egraph.add(ENode(literal_operator(c), tuple())))
+        # Keep the leaves, there could be a symbol like `x` which
+        # turned out to be constant too
+        egraph.prune(a, lambda n: not n.operands)
@@ -0,0 +1,33 @@
+from egraph import *
+from extract import Extractor
+from herbie_rules import ac, reverse, add_commutative, add_associative, add_identity_right, add_inverse_left, add_inverse_right
+from runner import Runner
+from time import perf_counter
+
+# Simplifying x0 + x1 + ... + x(n-1) + negate(x0) + 0 with the rules
+# for sums, with commutativity and associativity as rewrites, and with
+# `+` declared AC instead. The rewrites add every bracketing and order
+# of the sum, so they run into the node limit; the AC e-graph
+# saturates with a handful of nodes more than the sum itself.
+
+simplify = [add_identity_right, add_inverse_left, add_inverse_right]
+rewrites = [add_commutative, add_associative, reverse(add_associative)]
+
+def term(n: int) -> Term:
+    xs = [Term(f"x{i}", tuple()) for i in range(n)]
+    t = xs[0]
+    for s in xs[1:] + [Term("negate", (xs[0],)), Term("0", tuple())]:
+        t = Term("+", (t, s))
+    return t
+
+print(f"{'n':>3} {'+':>9} {'stop':>15} {'nodes':>7} {'best':>5} {'seconds':>8}")
+for n in (2, 4, 8, 16):
+    for name, g, rs in [("rewrites", EGraph(), rewrites + simplify), ("AC", EGraph(ac=ac), simplify)]:
+        a = g.add_term(term(n))
+        g.rebuild()
+        t = perf_counter()
+        report = Runner(g, rs, iteration_limit=30, node_limit=10_000, time_limit=30).run()
+        g.rebuild()
+        t = perf_counter() - t
+        cost, _ = Extractor(g).find_best(a)
+        print(f"{n:>3} {name:>9} {report.stop_reason.value:>15} {g.count_nodes():>7} {cost:>5} {t:>8.2f}")
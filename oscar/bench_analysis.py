@@ -0,0 +1,40 @@
+from egraph import *
+from analysis import ConstantFolding
+from herbie_rules import rules
+from time import perf_counter
+
+# Saturating constant-heavy terms with `herbie_rules.rules`, with and
+# without the constant folding analysis.
+#
+# The terms are polynomials in `x` with small integer coefficients,
+# written out the long way, like (2 * x) * (3 + 4) + (5 - 1) * 1.
+
+def terms(k: int) -> list[Term]:
+    x = Term("x", tuple())
+    def c(i: int) -> Term:
+        return Term(str(i), tuple())
+    ts = list()
+    for i in range(k):
+        t = Term("+", (
+            Term("*", (Term("*", (c(i + 2), x)), Term("+", (c(3), c(i))))),
+            Term("*", (Term("-", (c(i + 5), c(1))), c(1))),
+        ))
+        ts.append(t)
+    return ts
+
+def build(k: int, analysis) -> EGraph:
+    g = EGraph(analysis)
+    for t in terms(k):
+        g.add_term(t)
+    g.rebuild()
+    return g
+
+print(f"{'k':>3} {'analysis':>16} {'nodes':>7} {'classes':>8} {'seconds':>8}")
+for k in (1, 2, 4):
+    for analysis in (None, ConstantFolding()):
+        g = build(k, analysis)
+        t = perf_counter()
+        g.run(rules, 3)
+        t = perf_counter() - t
+        name = type(analysis).__name__ if analysis is not None else "none"
+        print(f"{k:>3} {name:>16} {g.count_nodes():>7} {len(g.classes):>8} {t:>8.2f}")
@@ -0,0 +1,36 @@
+from egraph import *
+from herbie_rules import rules, add_commutative, multiply_commutative, add_identity_right, multiply_annihilator_right, multiply_identity_right
+from runner import Runner
+
+# Node counts for the e-graphs of `egg_example.py` and
+# `herbie_example.py`, as they are and with `+` and `*` declared
+# commutative, so `a + b` and `b + a` are one node. The rules are the
+# same either way; the commutativity rules just find nothing to add.
+
+def term(f: str, *ts: Term) -> Term:
+    return Term(f, ts)
+
+egg_rules = [
+    add_commutative, multiply_commutative,
+    add_identity_right,
+    multiply_annihilator_right, multiply_identity_right
+]
+
+print(f"{'example':>8} {'commutative':>11} {'iterations':>10} {'nodes per iteration'}")
+for commutative in [(), ("+", "*")]:
+    g = EGraph(commutative=commutative)
+    for t in [term("+", term("0"), term("*", term("1"), term("foo"))), term("*", term("0"), term("42"))]:
+        g.add_term(t)
+    g.rebuild()
+    report = Runner(g, egg_rules).run()
+    print(f"{'egg':>8} {' '.join(commutative) or '-':>11} {report.iterations:>10} {[it.nodes for it in report.history]}")
+
+for commutative in [(), ("+", "*")]:
+    one = term("1")
+    x = term("x")
+    g = EGraph(commutative=commutative)
+    a = g.add_term(term("/", term("-", one, term("sin", x)), term("cos", x)))
+    b = g.add_term(term("/", term("cos", x), term("+", one, term("sin", x))))
+    g.rebuild()
+    report = Runner(g, rules, iteration_limit=3, goals=[(a, b)]).run()
+    print(f"{'herbie':>8} {' '.join(commutative) or '-':>11} {report.iterations:>10} {[it.nodes for it in report.history]}")
@@ -0,0 +1,43 @@
+from egraph import *
+from herbie_rules import rules
+from time import perf_counter
+
+# How the cost of matching every rule in `herbie_rules.rules` scales
+# with the size of the e-graph, with and without the operator index.
+#
+# The graphs are made of `k` copies of the herbie example, each over a
+# different variable, saturated for two iterations, so the graph grows
+# linearly with `k`.
+
+def build(k: int) -> EGraph:
+    g = EGraph()
+    for i in range(k):
+        one = Term("1", tuple())
+        x = Term(f"x{i}", tuple())
+        sin_x = Term("sin", (x,))
+        cos_x = Term("cos", (x,))
+        g.add_term(Term("/", (Term("-", (one, sin_x)), cos_x)))
+        g.add_term(Term("/", (cos_x, Term("+", (one, sin_x)))))
+    g.rebuild()
+    g.run(rules, 2)
+    return g
+
+def scan(g: EGraph, q: Program) -> list[tuple[Substitution, EClassId]]:
+    # What `ematch` did before the index: run the program everywhere
+    return [m for a in g.classes.keys() for m in g.run_program(q, a)]
+
+def time(f) -> float:
+    t = perf_counter()
+    f()
+    return perf_counter() - t
+
+# `roots` counts how many (rule, e-class) pairs the program is started
+# on; without the index that is every e-class for every rule.
+print(f"{'copies':>6} {'nodes':>7} {'classes':>7} {'scan roots':>10} {'index roots':>11} {'scan (s)':>9} {'index (s)':>9}")
+for k in [1, 2, 4]:
+    g = build(k)
+    scan_roots = len(rules) * len(g.classes)
+    index_roots = sum(len(g.roots(r.program)) for r in rules)
+    t_scan = time(lambda: [scan(g, r.program) for r in rules])
+    t_index = time(lambda: [g.ematch(r.left, r.program) for r in rules])
+    print(f"{k:>6} {g.count_nodes():>7} {len(g.classes):>7} {scan_roots:>10} {index_roots:>11} {t_scan:>9.3f} {t_index:>9.3f}")
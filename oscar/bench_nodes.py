@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from egraph import ENode
+from node_store import NodeStore
+from random import Random
+
+import tracemalloc
+
+# Memory per e-node for the frozen dataclass nodes `egraph.py` used to
+# have, the `__slots__` nodes it has now, and the struct-of-arrays
+# `NodeStore`. Each representation is measured with and without a
+# hash-cons (a dict from node to e-class id for the node objects, the
+# store's own index for `NodeStore`).
+
+@dataclass(frozen=True)
+class DataclassENode:
+    operator: str
+    operands: tuple[int]
+
+def random_nodes(n: int) -> list[tuple[str, tuple[int, ...]]]:
+    random = Random(0)
+    operators = [("+", 2), ("*", 2), ("-", 2), ("/", 2), ("negate", 1), ("sin", 1), ("x", 0)]
+    nodes = list()
+    for i in range(n):
+        f, k = random.choice(operators)
+        nodes.append((f, tuple(random.randrange(n) for _ in range(k))))
+    return nodes
+
+def measure(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+def objects(cls, nodes, hash_cons: bool):
+    def build():
+        ns = [cls(f, tuple(operands)) for f, operands in nodes]
+        if hash_cons:
+            return ns, { n: i for i, n in enumerate(ns) }
+        return ns
+    return build
+
+def store(nodes, hash_cons: bool):
+    def build():
+        s = NodeStore()
+        for f, operands in nodes:
+            s.add(f, operands)
+        if not hash_cons:
+            s.by_hash = dict()
+            s.collisions = dict()
+        return s
+    return build
+
+n = 200_000
+nodes = random_nodes(n)
+# Make sure the operators are interned before measuring
+ENode("x", ())
+
+print(f"{'representation':<20} {'bytes/node':>10} {'with hash-cons':>14}")
+for name, build in [
+        ("dataclass", lambda h: objects(DataclassENode, nodes, h)),
+        ("__slots__", lambda h: objects(ENode, nodes, h)),
+        ("NodeStore", lambda h: store(nodes, h)),
+]:
+    print(f"{name:<20} {measure(build(False)) / n:>10.1f} {measure(build(True)) / n:>14.1f}")
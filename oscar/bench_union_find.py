@@ -0,0 +1,45 @@
+from random import Random
+from time import perf_counter
+from union_find import UnionFind, ArrayUnionFind
+
+import union_find
+
+# Millions of random unions on `UnionFind` and `ArrayUnionFind`, then
+# resolving every id: one `find` at a time, with `find_many`, and with
+# `canonicalize_all`.
+
+n = 2_000_000
+random = Random(0)
+pairs = [(random.randrange(n), random.randrange(n)) for _ in range(n)]
+
+def time(f) -> float:
+    t = perf_counter()
+    f()
+    return perf_counter() - t
+
+for name, cls in [("UnionFind", UnionFind), ("ArrayUnionFind", ArrayUnionFind)]:
+    u = cls()
+    t_add = time(lambda: [u.add() for _ in range(n)])
+    t_union = time(lambda: [u.union(x, y) for x, y in pairs])
+    t_find = time(lambda: [u.find(x) for x in range(n)])
+    print(f"{name:<16} add {t_add:6.2f}s  union {t_union:6.2f}s  find all {t_find:6.2f}s")
+
+u = ArrayUnionFind()
+for _ in range(n):
+    u.add()
+for x, y in pairs:
+    u.union(x, y)
+ids = list(range(n))
+print(f"{'find_many':<16} {time(lambda: u.find_many(ids)):6.2f}s")
+print(f"{'canonicalize_all':<16} {time(u.canonicalize_all):6.2f}s")
+
+u = ArrayUnionFind()
+for _ in range(n):
+    u.add()
+for x, y in pairs:
+    u.union(x, y)
+numpy = union_find.numpy
+union_find.numpy = None
+print(f"{'find_many (no numpy)':<16} {time(lambda: u.find_many(ids)):6.2f}s")
+print(f"{'canonicalize_all (no numpy)':<16} {time(u.canonicalize_all):6.2f}s")
+union_find.numpy = numpy
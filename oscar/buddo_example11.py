@@ -1,6 +1,6 @@
 from egraph_buddo4 import *
 from rules4 import rules
-from itertools import chain
+from runner import Runner, StopReason
 
 import sympy
 
@@ -41,25 +41,16 @@ g.rebuild()
 # print(g.find(b0), g.find(b1))
 print(g.find(c0), g.find(c1))
 
-for i in range(1, 1000+1):
-    k = g.count_nodes()
-    ms = list(chain.from_iterable((
-        ((r, s, a) for (s, a) in g.ematch(r.left))
-        for r in rules
-    )))
-    print(i, k)
-                    
-    for (r, s, a) in ms:
-        b = g.substitute_add(r.right, s)
-        g.union(a, b)
-    g.rebuild()
-
-    if k == g.count_nodes():
-        print(f"saturated after {i} iterations")
-        break
-    if g.find(c0) == g.find(c1):
-        print(f"breaking early on iteration {i}, c0 == c1")
-        break
+report = Runner(g, rules, iteration_limit=1000, time_limit=600.0, goals=[(c0, c1)]).run()
+for k, it in enumerate(report.history, 1):
+    print(k, it.nodes)
+match report.stop_reason:
+    case StopReason.SATURATED:
+        print(f"saturated after {report.iterations} iterations")
+    case StopReason.GOAL:
+        print(f"breaking early on iteration {report.iterations}, c0 == c1")
+    case reason:
+        print(f"stopped after {report.iterations} iterations: {reason.value}")
 
 # print(g.find(b0), g.find(b1))
 print(g.find(c0), g.find(c1))
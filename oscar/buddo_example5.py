@@ -1,6 +1,6 @@
 from egraph_buddo4 import *
+from rules4 import divide_exact_nontrivial
 from pprint import pprint
-from pyrsistent import pbag
 
 import sympy
 import itertools
@@ -43,20 +43,7 @@ g.rebuild()
 # for a, ns in g.classes.items():
 #     print(a, "   ", ns)
 
-for i in range(50):
-    matches = set()
-    for a in g.classes.keys():
-        for b in g.classes.keys():
-            q, r = sympy.div(a, b, g.ids)
-            if g.find(r) == 0 and a != 1 and b != 1 and a != b:
-                matches.add((a, pbag([b, g.find(q)])))
-    for a, bq in matches:
-        b, q = list(bq)
-        c = g.add(ENode("/", [a, b]))
-        d = g.add(ENode("/", [a, q]))
-        g.union(c, q)
-        g.union(d, b)
-    g.rebuild()
+g.run([divide_exact_nontrivial], 50)
 
 for a, ns in g.classes.items():
     print(a, "   ", ns)
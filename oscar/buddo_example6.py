@@ -1,6 +1,7 @@
 from egraph_buddo4 import *
+from rules4 import divide_exact_nontrivial
+from runner import Runner, StopReason
 from pprint import pprint
-from pyrsistent import pbag
 
 import sympy
 import itertools
@@ -40,27 +41,9 @@ a7 = g.add_term(one_minus_sin_divide_cos)
 a8 = g.add_term(cos_divide_one_add_sin)
 g.rebuild()
 
-for i in range(1, 1_001):
-    k = g.count_nodes()
-
-    matches = set()
-    for a in g.classes.keys():
-        for b in g.classes.keys():
-            q, r = sympy.div(a, b, g.ids)
-            if g.find(r) == 0 and a != 1 and b != 1 and a != b:
-                matches.add((a, pbag([b, g.find(q)])))
-
-    for a, bq in matches:
-        b, q = list(bq)
-        c = g.add(ENode("/", [a, b]))
-        d = g.add(ENode("/", [a, q]))
-        g.union(c, q)
-        g.union(d, b)
-    g.rebuild()
-
-    if k == g.count_nodes():
-        print(f"saturated after {i} iterations")
-        break
+report = Runner(g, [divide_exact_nontrivial], iteration_limit=1000, time_limit=600.0).run()
+if report.stop_reason == StopReason.SATURATED:
+    print(f"saturated after {report.iterations} iterations")
 
 for a, ns in g.classes.items():
     print(a, "   ", ns)
@@ -1,6 +1,7 @@
 from egraph_buddo4 import *
+from rules4 import divide_exact
+from runner import Runner, StopReason
 from pprint import pprint
-from pyrsistent import pbag
 
 import sympy
 import itertools
@@ -43,26 +44,11 @@ g.rebuild()
 for c in g.classes.values():
     print(c)
 
-for i in range(1, 1_001):
-    k = g.count_nodes()
-    print(i, k)
-
-    matches = set()
-    for a in g.classes.keys():
-        for b in g.classes.keys():
-            q, r = sympy.div(a, b, g.ids)
-            if g.find(r) == 0:
-                matches.add((a, b, g.find(q)))
-    for a, b, q in matches:
-        c = g.add(ENode("/", [a, b]))
-        d = g.add(ENode("/", [a, q]))
-        g.union(c, q)
-        g.union(d, b)
-    g.rebuild()
-
-    if k == g.count_nodes():
-        print(f"saturated after {i} iterations")
-        break
+report = Runner(g, [divide_exact], iteration_limit=1000, time_limit=600.0).run()
+for k, it in enumerate(report.history, 1):
+    print(k, it.nodes)
+if report.stop_reason == StopReason.SATURATED:
+    print(f"saturated after {report.iterations} iterations")
 
 for a, ns in g.classes.items():
     print(a, "   ", ns)
@@ -1,4 +1,5 @@
 from egraph import *
+from extract import Extractor
 
 # Example from the docs.rs page for egg
 # https://docs.rs/egg/latest/egg/index.html
@@ -52,4 +53,8 @@ print(g.find(foo_id) == g.find(term1_id))
 print(g.find(zero_id) == g.find(term2_id))
 print(g.find(one_id) == g.find(zero_id))
 
+extractor = Extractor(g)
+print(extractor.find_best(term1_id))
+print(extractor.find_best(term2_id))
+
 print("We can do the egg example!")
@@ -1,10 +1,10 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from functools import reduce
-from itertools import chain, groupby
+from functools import cached_property, reduce
+from itertools import chain, groupby, permutations
 from pprint import pprint
 from pyrsistent import pmap
-from typing import Union, Mapping
+from typing import Any, Callable, Iterable, Union, Mapping
 from union_find import UnionFind
 
 # From https://www.philipzucker.com/egraph-1/:
@@ -28,15 +28,79 @@ class Term:
     # Tuples are hashable, lists are not
     operands: tuple[Term]
 
-@dataclass(frozen=True)
+# Operators are interned: every node with a given operator points at
+# the same string, and each operator gets a small integer id for
+# array-backed storage like `node_store.NodeStore`.
+_operator_names: list[str] = list()
+_operator_ids: dict[str, int] = dict()
+
+def intern_operator(f: str) -> int:
+    """
+    The interned id of the operator `f`.
+    """
+    if (k := _operator_ids.get(f)) is not None:
+        return k
+    k = len(_operator_names)
+    _operator_names.append(f)
+    _operator_ids[f] = k
+    return k
+
+def operator_name(k: int) -> str:
+    """
+    The operator interned as `k`.
+    """
+    return _operator_names[k]
+
 class ENode:
+    """
+    An operator applied to e-class ids.
+
+    There are a lot of these, so instead of a frozen dataclass this is
+    a `__slots__` class with an interned operator and a cached hash:
+    no per-node `__dict__`, and no rehashing every time a node goes in
+    or out of the hash-cons. See `bench_nodes.py`.
+    """
+    __slots__ = ("operator", "operands", "_hash")
+    __match_args__ = ("operator", "operands")
+
     operator: str
     operands: tuple[EClassId]
 
+    def __init__(self, operator: str, operands: tuple[EClassId]):
+        self.operator = _operator_names[intern_operator(operator)]
+        self.operands = tuple(operands)
+        self._hash = hash((self.operator, self.operands))
+
+    @property
+    def op(self) -> int:
+        return _operator_ids[self.operator]
+
+    def with_operands(self, operands: tuple[EClassId]) -> ENode:
+        """
+        The same operator applied to `operands`, skipping the interning.
+        """
+        n = ENode.__new__(ENode)
+        n.operator = self.operator
+        n.operands = operands
+        n._hash = hash((self.operator, operands))
+        return n
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ENode) and self._hash == other._hash \
+            and self.operator == other.operator and self.operands == other.operands
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"ENode(operator={self.operator!r}, operands={self.operands!r})"
+
 @dataclass
 class EClass:
     nodes: list[ENode]
     parents: list[tuple[ENode, EClassId]]
+    # Whatever the e-graph's `Analysis` knows about the e-class
+    data: Any = None
 
 @dataclass(frozen=True)
 class PatternVariable:
@@ -51,13 +115,596 @@ Pattern = Union[PatternTerm, PatternVariable]
 
 Substitution = Mapping[PatternVariable, EClassId]
 
+# Matches are found as slot tuples rather than maps: a rule numbers the
+# variables of its left-hand side in order of first appearance (see
+# `pattern_variables`), and the e-class bound to variable `i` goes in
+# slot `i`. Tuples are much cheaper to build and hash than maps.
+Slots = tuple[EClassId, ...]
+
+# A right-hand side with its variables replaced by their slots: either
+# a slot, or an operator and the templates of its operands
+Template = Union[int, tuple[str, tuple["Template", ...]]]
+
 @dataclass(frozen=True)
 class Rule:
     left: Pattern
-    right: Pattern
+    # Added and unioned with the e-class that matched. Leave it out
+    # when there's an `applier` instead.
+    right: Pattern | None = None
+    # Only matches `guard(s, g)` accepts are applied. It's checked
+    # before anything is added, so rejected matches cost nothing.
+    guard: Callable[[Substitution, EGraph], bool] | None = None
+    # Called as `applier(s, g)` instead of adding `right`. It can add
+    # and union whatever it likes, and returns an e-class to union with
+    # the one that matched, or `None`.
+    applier: Callable[[Substitution, EGraph], EClassId | None] | None = None
+
+    def __post_init__(self):
+        if (self.right is None) == (self.applier is None):
+            raise ValueError("a rule needs exactly one of a right-hand side and an applier")
+
+    @cached_property
+    def program(self) -> Program:
+        """
+        The left-hand side compiled for the e-matching machine, for an
+        e-graph without commutative operators (see `EGraph.plan`).
+        """
+        # Compiled the first time it's asked for. `cached_property`
+        # writes straight into the instance `__dict__`, so this works
+        # even though the dataclass is frozen.
+        return compile_pattern(self.left)
+
+    @cached_property
+    def query(self) -> Query:
+        """
+        The left-hand side compiled for generic join.
+        """
+        return compile_query(self.left)
+
+    @cached_property
+    def depth(self) -> int:
+        return pattern_depth(self.left)
+
+    @cached_property
+    def operators(self) -> tuple[str, ...]:
+        """
+        The operators the left-hand side mentions.
+        """
+        return pattern_operators(self.left)
+
+    @cached_property
+    def variables(self) -> tuple[str, ...]:
+        """
+        The variables of the left-hand side, in slot order.
+        """
+        return pattern_variables(self.left)
+
+    @cached_property
+    def template(self) -> Template:
+        """
+        The right-hand side with its variables replaced by slots.
+        """
+        return compile_template(self.right, self.variables)
+
+    def substitution(self, s: Slots) -> dict[str, EClassId]:
+        """
+        The slots `s` as a map from variable names, for guards and
+        appliers.
+        """
+        return dict(zip(self.variables, s))
+
+def pattern_operators(p: Pattern) -> tuple[str, ...]:
+    """
+    The operators of `p`, each once, in order of first appearance.
+    """
+    operators = dict()
+    def visit(p: Pattern):
+        match p:
+            case PatternTerm(f, ps):
+                operators.setdefault(f, None)
+                for q in ps:
+                    visit(q)
+    visit(p)
+    return tuple(operators.keys())
+
+def pattern_variables(p: Pattern) -> tuple[str, ...]:
+    """
+    The variables of `p` in order of first appearance, left to right.
+    """
+    variables = dict()
+    def visit(p: Pattern):
+        match p:
+            case PatternVariable(x):
+                variables.setdefault(x, None)
+            case PatternTerm(_, ps):
+                for q in ps:
+                    visit(q)
+    visit(p)
+    return tuple(variables.keys())
+
+def compile_template(p: Pattern, variables: tuple[str, ...]) -> Template:
+    """
+    Replace each variable in `p` by its index in `variables`.
+    """
+    match p:
+        case PatternVariable(x):
+            if x not in variables:
+                raise ValueError(f"variable {x!r} isn't bound by the left-hand side")
+            return variables.index(x)
+        case PatternTerm(f, ps):
+            return (f, tuple(compile_template(q, variables) for q in ps))
+
+def pattern_depth(p: Pattern) -> int:
+    """
+    How many parent edges separate the root of a match of `p` from the
+    deepest e-class the match looks at.
+    """
+    match p:
+        case PatternVariable(_):
+            return 0
+        case PatternTerm(_, []) | PatternTerm(_, ()):
+            return 0
+        case PatternTerm(_, ps):
+            return 1 + max(pattern_depth(q) for q in ps)
+
+def flatten_pattern(p: Pattern, ac: frozenset[str]) -> Pattern:
+    """
+    Splice the operands of nested terms with the same AC operator into
+    their parent, so `+(x, +(y, z))` becomes `+(x, y, z)`.
+    """
+    match p:
+        case PatternTerm(f, ps) if ps:
+            qs = list()
+            for q in ps:
+                q = flatten_pattern(q, ac)
+                if f in ac and isinstance(q, PatternTerm) and q.operator == f:
+                    qs.extend(q.operands)
+                else:
+                    qs.append(q)
+            return PatternTerm(f, qs)
+        case _:
+            return p
+
+# The e-matching virtual machine from egg (see `machine.rs` and
+# section 5.1 of "Efficient E-matching for SMT Solvers"). Instead of
+# walking a pattern recursively on every match, each pattern is
+# compiled once into a flat program which runs against a register
+# array of e-class ids. Register 0 holds the root e-class.
+
+@dataclass(frozen=True)
+class Bind:
+    """
+    For each node in the e-class in `register` with the right operator
+    and arity, write its (canonical) children into the registers
+    starting at `out` and run the rest of the program.
+    """
+    register: int
+    operator: str
+    arity: int
+    out: int
+
+@dataclass(frozen=True)
+class BindAC:
+    """
+    `Bind` for an associative-commutative operator. The `arity`
+    pattern operands match the operands of a node in any order, and if
+    the node has more operands than that, a pattern variable at one of
+    the offsets in `rest` takes all the ones left over. See
+    `EGraph.assignments`.
+
+    With `extend`, the pattern can also match just some of the
+    operands, leaving the others alone, as if it had one more variable
+    for them (see `Extension`).
+    """
+    register: int
+    operator: str
+    arity: int
+    out: int
+    rest: tuple[int, ...]
+    extend: bool = False
+
+@dataclass(frozen=True)
+class Extension:
+    """
+    The root of a match of an AC pattern against only some of the
+    operands of a node in the e-class `a`. The match is really at
+    `node`, which has just those operands, and `rest` are the ones
+    left over. `EGraph.extend` adds `node`, and makes `a` equal to
+    its sum with the rest.
+    """
+    a: EClassId
+    node: ENode
+    rest: tuple[EClassId, ...]
+
+@dataclass(frozen=True)
+class Compare:
+    """
+    Fail unless registers `i` and `j` hold the same e-class. Emitted
+    for the second and later occurrences of a pattern variable.
+    """
+    i: int
+    j: int
+
+@dataclass(frozen=True)
+class CompareGround:
+    """
+    Fail unless register `i` holds the e-class of ground subterm `k`
+    of the program. Emitted for subterms without variables, like the
+    `0` in `+(x, 0)`, which are looked up in the hash-cons instead of
+    matched node by node.
+    """
+    i: int
+    k: int
+
+@dataclass(frozen=True)
+class Yield:
+    """
+    Report a match, reading each variable out of its register. The
+    variables are in slot order.
+    """
+    variables: tuple[str, ...]
+    registers: tuple[int, ...]
+
+Instruction = Union[Bind, BindAC, Compare, CompareGround, Yield]
+
+@dataclass(frozen=True)
+class Program:
+    instructions: tuple[Instruction, ...]
+    # Number of registers the program needs
+    size: int
+    # The ground subterms, as templates (see `Rule.template`) without
+    # any slots
+    ground: tuple[Template, ...] = ()
+
+    def explain(self) -> str:
+        """
+        The program as readable text, one instruction per line.
+        """
+        lines = list()
+        for instruction in self.instructions:
+            match instruction:
+                case Bind(i, f, k, out):
+                    operands = ", ".join(f"${out + j}" for j in range(k))
+                    lines.append(f"bind ${i} to {f}({operands})")
+                case BindAC(i, f, k, out, rest, extend):
+                    operands = ", ".join(f"${out + j}" for j in range(k))
+                    line = f"bind ${i} to {f}({operands}) in any order"
+                    if rest:
+                        line += f", the rest in {' or '.join(f'${out + j}' for j in rest)}"
+                    if extend:
+                        line += ", or some of it"
+                    lines.append(line)
+                case Compare(i, j):
+                    lines.append(f"compare ${i} = ${j}")
+                case CompareGround(i, k):
+                    lines.append(f"compare ${i} = {template_str(self.ground[k])}")
+                case Yield(xs, rs):
+                    bindings = ", ".join(f"{x} = ${r}" for x, r in zip(xs, rs))
+                    lines.append(f"yield {bindings}")
+        return "\n".join(lines)
+
+# Query planning for the e-matching machine. The root of a pattern is
+# always bound first, but the order the machine visits sibling
+# subterms in is up to us, and it matters: every `Bind` loops over the
+# nodes it finds, so putting the subterms which fail most often first
+# cuts the search off sooner. Lacking anything better, a subterm is
+# considered selective if
+#
+# 1. it mentions a variable that's already bound, so it ends in a
+#    `Compare` which can reject the match, or failing that
+# 2. there are few nodes in the e-graph with some operator in it, or
+#    failing that, with its own operator.
+#
+# The node counts only need to be roughly right, so `EGraph.plan`
+# buckets them by order of magnitude and only compiles a rule again
+# when one of its operators changes bucket.
+
+def template_str(t: Template) -> str:
+    if isinstance(t, int):
+        return f"${t}"
+    (f, ts) = t
+    if not ts:
+        return f
+    return f"{f}({', '.join(template_str(u) for u in ts)})"
+
+def compile_pattern(p: Pattern, cardinality: Callable[[str], int] | None = None, ac: frozenset[str] = frozenset(), commutative: frozenset[str] = frozenset()) -> Program:
+    """
+    Compile a pattern into a program for the e-matching machine.
+
+    If `cardinality` is given, it's the (approximate) number of nodes
+    with a given operator, and is used to order sibling subterms.
+    Otherwise they're visited left to right. Terms with an operator in
+    `ac` are matched modulo associativity and commutativity, and those
+    with an operator in `commutative` with their operands in any order.
+    """
+    p = flatten_pattern(p, ac)
+    # Variables which appear only once, and can take the rest of the
+    # operands of an AC node without having to equal anything
+    occurrences = dict()
+    def count(p: Pattern):
+        match p:
+            case PatternVariable(x):
+                occurrences[x] = occurrences.get(x, 0) + 1
+            case PatternTerm(_, ps):
+                for q in ps:
+                    count(q)
+    count(p)
+    instructions = list()
+    # Maps pattern variables to the register they were first bound in
+    variables = dict()
+    # Maps ground subterms to their index in `Program.ground`
+    ground = dict()
+    size = 1
+
+    def selectivity(q: PatternTerm) -> tuple[int, int, int]:
+        bound = sum(1 for x in pattern_variables(q) if x in variables)
+        # A rare operator anywhere in the subterm makes it fail often
+        rarest = min(cardinality(f) for f in pattern_operators(q))
+        return (-bound, rarest, cardinality(q.operator))
+
+    def visit(p: Pattern, i: int):
+        nonlocal size
+        match p:
+            case PatternVariable(x):
+                if x in variables:
+                    instructions.append(Compare(variables[x], i))
+                else:
+                    variables[x] = i
+            case PatternTerm(_, _) if not pattern_variables(p):
+                t = compile_template(p, ())
+                k = ground.setdefault(t, len(ground))
+                instructions.append(CompareGround(i, k))
+            case PatternTerm(f, ps):
+                out = size
+                size += len(ps)
+                if f in ac:
+                    rest = tuple(j for j, q in enumerate(ps) if isinstance(q, PatternVariable))
+                    # At the root, a pattern which has no variable to
+                    # take the rest, like `+(negate(x), x)`, can match
+                    # inside a longer sum
+                    extend = i == 0 and not any(occurrences[ps[j].identifier] == 1 for j in rest)
+                    instructions.append(BindAC(i, f, len(ps), out, rest, extend))
+                elif f in commutative:
+                    # The same thing, minus the rest
+                    instructions.append(BindAC(i, f, len(ps), out, ()))
+                else:
+                    instructions.append(Bind(i, f, len(ps), out))
+                # Handle the variables and ground subterms directly
+                # under this node first, so they're compared as early
+                # as possible, before descending into the subterms.
+                for j, q in enumerate(ps):
+                    if isinstance(q, PatternVariable) or not pattern_variables(q):
+                        visit(q, out + j)
+                subterms = [(j, q) for j, q in enumerate(ps) if isinstance(q, PatternTerm) and pattern_variables(q)]
+                # Pick the most selective subterm given what's bound so
+                # far, one at a time, since each one visited binds more
+                while subterms:
+                    if cardinality is not None:
+                        k = min(range(len(subterms)), key=lambda k: selectivity(subterms[k][1]))
+                    else:
+                        k = 0
+                    j, q = subterms.pop(k)
+                    visit(q, out + j)
+
+    visit(p, 0)
+    xs = pattern_variables(p)
+    instructions.append(Yield(xs, tuple(variables[x] for x in xs)))
+    return Program(tuple(instructions), size, tuple(ground.keys()))
+
+# Relational e-matching, from "Relational E-Matching" (Zhang, Wang,
+# Willsey and Tatlock). Every e-node `f(b, c)` in e-class `a` is a row
+# `(a, b, c)` in the relation for `f`. A pattern becomes a conjunctive
+# query with one atom per pattern term, where the e-class of each
+# pattern term is a fresh query variable. For example,
+#
+#   +(negate(x), x)  ~>  +(v0, v1, x), negate(v1, x)
+#
+# The query is answered with generic join, which binds one variable at
+# a time by intersecting the candidates from every atom it appears in.
+# Repeated variables like `x` above are joined on, not checked after
+# the fact.
+
+@dataclass(frozen=True)
+class Atom:
+    operator: str
+    # Query variables for the e-class of the node, then its children
+    variables: tuple[int, ...]
+
+@dataclass(frozen=True)
+class Query:
+    atoms: tuple[Atom, ...]
+    # The order generic join binds the query variables in
+    order: tuple[int, ...]
+    # Pattern variables (in slot order) and the query variable each
+    # one became
+    variables: tuple[str, ...]
+    slots: tuple[int, ...]
+    # Query variable for the e-class of the whole pattern
+    root: int
+
+def compile_query(p: Pattern) -> Query:
+    """
+    Compile a pattern into a conjunctive query.
+    """
+    atoms = list()
+    variables = dict()
+    k = 0
+
+    def visit(p: Pattern) -> int:
+        nonlocal k
+        match p:
+            case PatternVariable(x):
+                if x not in variables:
+                    variables[x] = k
+                    k += 1
+                return variables[x]
+            case PatternTerm(f, ps):
+                v = k
+                k += 1
+                atoms.append(Atom(f, (v, *(visit(q) for q in ps))))
+                return v
+
+    root = visit(p)
+
+    # Greedy variable ordering: prefer variables that are constrained
+    # by the most atoms, breaking ties towards variables which share an
+    # atom with something already bound, so each step is a join and
+    # not a cross product.
+    order = list()
+    bound = set()
+    while len(order) < k:
+        def score(v: int) -> tuple[int, int, int]:
+            occurs = [a for a in atoms if v in a.variables]
+            connected = sum(1 for a in occurs if bound & set(a.variables))
+            return (connected, len(occurs), -v)
+        v = max((v for v in range(k) if v not in bound), key=score)
+        order.append(v)
+        bound.add(v)
+
+    return Query(tuple(atoms), tuple(order), tuple(variables.keys()), tuple(variables.values()), root)
+
+@dataclass
+class ApplyReport:
+    matches: int
+    # Matches skipped because the same rule matched with the same
+    # (canonical) substitution at the same e-class
+    duplicates: int
+    # Matches skipped because their right-hand side was already in the
+    # e-class that matched
+    present: int
+    # Matches the rule's guard rejected
+    rejected: int
+    unions: int
+
+    @property
+    def skipped(self) -> int:
+        return self.duplicates + self.present + self.rejected
+
+class SimpleScheduler:
+    """
+    Decides which rules `EGraph.run` searches and applies in each
+    iteration. This one lets everything through.
+    """
+    def search_rule(self, i: int, r: Rule, search: Callable[[], list[tuple[Slots, EClassId]]]) -> list[tuple[Slots, EClassId]] | None:
+        """
+        Return the matches of `r` to apply in iteration `i`, calling
+        `search` to find them, or `None` to skip `r` this iteration.
+        """
+        return search()
+
+    def can_stop(self, i: int) -> bool:
+        """
+        Called when iteration `i` didn't change the e-graph. Return
+        `False` to keep going anyway.
+        """
+        return True
+
+@dataclass
+class RuleStats:
+    match_limit: int
+    ban_length: int
+    times_applied: int = 0
+    times_banned: int = 0
+    banned_until: int = 0
+
+class BackoffScheduler(SimpleScheduler):
+    """
+    Egg's backoff scheduler. A rule which matches more than its match
+    limit in one iteration is banned for its ban length. Each ban
+    doubles both the limit and the ban length for that rule, so
+    explosive rules like commutativity and associativity run less and
+    less often instead of flooding the e-graph.
+    """
+    def __init__(self, match_limit: int = 1_000, ban_length: int = 5):
+        self.match_limit = match_limit
+        self.ban_length = ban_length
+        # Maps the ids of rules to their stats
+        self.stats = dict()
+
+    def rule_stats(self, r: Rule) -> RuleStats:
+        if id(r) not in self.stats:
+            self.stats[id(r)] = RuleStats(self.match_limit, self.ban_length)
+        return self.stats[id(r)]
+
+    def limit_rule(self, r: Rule, match_limit: int, ban_length: int):
+        """
+        Give `r` its own match limit and ban length.
+        """
+        s = self.rule_stats(r)
+        s.match_limit = match_limit
+        s.ban_length = ban_length
+
+    def search_rule(self, i: int, r: Rule, search: Callable[[], list[tuple[Slots, EClassId]]]) -> list[tuple[Slots, EClassId]] | None:
+        s = self.rule_stats(r)
+        if i < s.banned_until:
+            return None
+
+        ms = search()
+        threshold = s.match_limit << s.times_banned
+        if len(ms) > threshold:
+            s.banned_until = i + (s.ban_length << s.times_banned)
+            s.times_banned += 1
+            return None
+        else:
+            s.times_applied += 1
+            return ms
+
+    def can_stop(self, i: int) -> bool:
+        # The e-graph only looks saturated because of the banned
+        # rules. Move every ban forward so the soonest one ends now.
+        banned = [s for s in self.stats.values() if s.banned_until > i]
+        if not banned:
+            return True
+        wait = min(s.banned_until for s in banned) - i
+        for s in banned:
+            s.banned_until -= wait
+        return False
+
+# E-class analyses, as in egg (Willsey et al., "egg: Fast and
+# Extensible Equality Saturation", section 4). Each e-class carries a
+# value from a semilattice: `make` computes it for a new node, `merge`
+# joins the values of two e-classes being unioned, and `modify` lets
+# the analysis change an e-class based on its value (adding nodes,
+# unions, or pruning nodes). When the value of an e-class changes, its
+# parents are made again during `rebuild`, so information flows up.
+class Analysis:
+    """
+    The analysis which knows nothing. Subclass this and override
+    `make`, `merge` and `modify`.
+    """
+    def make(self, egraph: EGraph, n: ENode) -> Any:
+        return None
+
+    def merge(self, x: Any, y: Any) -> Any:
+        return x
+
+    def modify(self, egraph: EGraph, a: EClassId):
+        pass
+
+# Commutative operators. A node for one of these has its operands
+# sorted by `canonicalize`, so `+(a, b)` and `+(b, a)` are hash-consed
+# to the same node and a commutativity rule never has anything to add.
+# Sorting by e-class id means a union can reorder the operands, and
+# `repair` sorts them again as it canonicalizes the parents. Patterns
+# for these operators match the operands in either order.
+#
+# Associative-commutative operators. Applying commutativity and
+# associativity as rewrites adds every ordering and bracketing of a sum
+# to the e-graph, which is exponential in its length. Instead, an
+# operator can be declared AC, and then
+#
+# - its nodes are flat: `a + (b + c)` is the single node `+(a, b, c)`,
+#   built that way by `add_term` and when adding right-hand sides,
+# - its operands are a multiset, kept sorted by `canonicalize`, so
+#   `b + a` and `a + b` are the same node, and
+# - its patterns match modulo AC (see `BindAC`).
+#
+# Flattening only happens as terms are built. A node `+(a, b)` whose
+# operand `b` turns out to contain a sum isn't flattened through the
+# e-class, which would never end for cycles like `x = x + 0`.
 
 class EGraph:
-    def __init__(self):
+    def __init__(self, analysis: Analysis | None = None, ac: Iterable[str] = (), commutative: Iterable[str] = ()):
         self.union_find = UnionFind()
         # Maps ENodes to e-class ids
         self.hash_cons = dict()
@@ -65,6 +712,35 @@ class EGraph:
         self.classes = dict()
         # List of e-class ids which need to be upward merged
         self.pending = list()
+        # Maps operators to the canonical ids of the e-classes
+        # containing a node with that operator, so e-matching only has
+        # to look at e-classes which could match at the root
+        self.operators = dict()
+        # Maps operators to the hash-consed nodes with that operator
+        self.operator_nodes = dict()
+        # E-classes created or changed (new nodes, unions) since the
+        # last time `run` looked, for semi-naive e-matching
+        self.touched = set()
+        # Number of distinct nodes across all e-classes, exact after
+        # each `rebuild`
+        self.node_count = 0
+        # The e-class analysis, and the parents whose e-class needs its
+        # data made again because the data of one of their operands
+        # changed
+        self.analysis = analysis if analysis is not None else Analysis()
+        self.analysis_pending = list()
+        # The associative-commutative operators, and the operators
+        # whose operands are sorted: the commutative ones, AC or not
+        self.ac = frozenset(ac)
+        self.commutative = frozenset(commutative) | self.ac
+        # Maps the id of each rule to its last program from `plan`,
+        # with the node counts it was planned for
+        self.plans = dict()
+        # The rules the last `search` skipped because they mention an
+        # operator which isn't in the e-graph
+        self.irrelevant = list()
+        # State for semi-naive e-matching across calls to `search`
+        self.reset_search()
 
     def find(self, a: EClassId) -> EClassId:
         """
@@ -75,9 +751,11 @@ class EGraph:
     def canonicalize(self, n: ENode) -> ENode:
         """
         Return a version `n` where each of its children are
-        canonical e-class ids.
+        canonical e-class ids, sorted if its operator is commutative.
         """
-        return ENode(n.operator, tuple((self.find(a) for a in n.operands)))
+        if n.operator in self.commutative:
+            return n.with_operands(tuple(sorted([self.find(a) for a in n.operands])))
+        return n.with_operands(tuple((self.find(a) for a in n.operands)))
 
     def add(self, n: ENode) -> EClassId:
         """
@@ -99,11 +777,18 @@ class EGraph:
             # Add node `n` to the parent lists of its children.
             #
             # We already canonicalized the children, so we don't need
-            # to do it again here.
-            for b in n.operands:
+            # to do it again here. An operand which appears twice
+            # only gets the parent once.
+            for b in set(n.operands):
                 self.classes[b].parents.append((n, a))
             self.classes[a] = e
             self.hash_cons[n] = a
+            self.node_count += 1
+            self.touched.add(a)
+            self.operators.setdefault(n.operator, set()).add(a)
+            self.operator_nodes.setdefault(n.operator, set()).add(n)
+            e.data = self.analysis.make(self, n)
+            self.analysis.modify(self, a)
             return a
 
     def add_term(self, t: Term) -> EClassId:
@@ -112,9 +797,24 @@ class EGraph:
         """
         return self.add(ENode(
             t.operator,
-            tuple((self.add_term(s) for s in t.operands))
+            tuple((self.add_term(s) for s in self.term_operands(t)))
         ))
 
+    def term_operands(self, t: Term) -> list[Term]:
+        """
+        The operands of `t`, with those of operands with the same AC
+        operator spliced in: `[a, b, c]` for `a + (b + c)`.
+        """
+        if t.operator not in self.ac:
+            return t.operands
+        ts = list()
+        for s in t.operands:
+            if s.operator == t.operator:
+                ts.extend(self.term_operands(s))
+            else:
+                ts.append(s)
+        return ts
+
     def union(self, a: EClassId, b: EClassId) -> bool:
         """
         Union two e-classes.
@@ -142,9 +842,25 @@ class EGraph:
             # Note: Egg adds the entire parent list here, but the egg
             # paper does not. This seems to work right now.
             self.pending.append(a)
+            self.touched.add(a)
                
             # Set M[a] := M[a] \cup M[b]
             e = self.classes.pop(b)
+
+            # Join the analysis data. The parents of whichever side
+            # learned something need their data made again.
+            d = self.analysis.merge(self.classes[a].data, e.data)
+            if d != self.classes[a].data:
+                self.analysis_pending.extend(self.classes[a].parents)
+            if d != e.data:
+                self.analysis_pending.extend(e.parents)
+            self.classes[a].data = d
+
+            # `b` is no longer canonical, `a` takes its place in the
+            # operator index
+            for f in { n.operator for n in e.nodes }:
+                self.operators[f].discard(b)
+                self.operators[f].add(a)
             self.classes[a].nodes.extend(e.nodes)
             self.classes[a].parents.extend((p, self.find(b)) for p, b in e.parents)
 
@@ -154,56 +870,122 @@ class EGraph:
         """
         Restore the hashcons and congruence invariants.
         """
-        # 1.
-        # while self.pending:
-        #     # TODO:
-        #     # pending = self.pending
-        #     # Remove duplicate consecutive entries
-        #     # https://stackoverflow.com/questions/5738901/removing-elements-that-have-consecutive-duplicates#5738933
-        #     # pending = [a for a, _ in groupby(self.pending)]
-        #     pending = self.
-        #     self.pending = list()
-        #     for a in pending:
-        #         self.repair(self.find(a))
+        # Egg-style deferred rebuilding. Each pass takes the whole
+        # worklist at once and groups it by canonical e-class, so an
+        # e-class unioned many times since the last pass is only
+        # repaired once. Repairing can union more e-classes, which go
+        # on the worklist for the next pass.
+        #
+        # Node lists are only cleaned up once the worklist is empty,
+        # when no more unions can happen. The e-classes whose nodes
+        # can have gone stale are the repaired ones (they took over
+        # the nodes of the e-classes unioned into them) and the
+        # e-classes of their parents (some operand of theirs changed).
+        dirty = set()
+        inserted = set()
+        while len(self.pending) > 0 or len(self.analysis_pending) > 0:
+            while len(self.pending) > 0:
+                pending = { self.find(a) for a in self.pending }
+                self.pending = list()
+
+                for a in pending:
+                    dirty |= self.repair(self.find(a), inserted)
 
-        # 2.
-        # while len(self.pending) > 0:
-        #     self.repair(self.find(self.pending.pop()))
+            # Propagate analysis data upwards until it stops changing.
+            # `modify` can add nodes and union e-classes, which puts
+            # more work on either list.
+            while len(self.analysis_pending) > 0:
+                (n, b) = self.analysis_pending.pop()
+                b = self.find(b)
+                e = self.classes[b]
+                d = self.analysis.merge(e.data, self.analysis.make(self, self.canonicalize(n)))
+                if d != e.data:
+                    e.data = d
+                    self.analysis_pending.extend(e.parents)
+                    self.analysis.modify(self, b)
 
-        # 3.
-        while len(self.pending) > 0:
-            pending = { self.find(a) for a in self.pending }
-            self.pending = list()
+        # A node with two operands that changed is fixed up once from
+        # the parent list of each. If a union happened in between, the
+        # first fix put a form of the node in the hash-cons which is
+        # already stale, and nothing points at it anymore.
+        for n in inserted:
+            m = self.canonicalize(n)
+            if m != n and n in self.hash_cons:
+                b = self.hash_cons.pop(n)
+                self.operator_nodes[n.operator].discard(n)
+                self.hash_cons.setdefault(m, self.find(b))
+                self.operator_nodes[m.operator].add(m)
 
-            for a in pending:
-                self.repair(self.find(a))
+        for a in { self.find(a) for a in dirty }:
+            e = self.classes[a]
+            # A dict rather than a set to keep the nodes in order
+            nodes = list(dict.fromkeys(self.canonicalize(n) for n in e.nodes))
+            self.node_count += len(nodes) - len(e.nodes)
+            e.nodes = nodes
 
-    def repair(self, a: EClassId):
+        # Same for the parent lists of the operands of every node
+        # which changed, which are the only ones with stale entries
+        for a in { self.find(b) for n in inserted for b in n.operands }:
+            e = self.classes[a]
+            e.parents = list({ self.canonicalize(n): self.find(b) for n, b in e.parents }.items())
+
+    def repair(self, a: EClassId, inserted: set[ENode]) -> set[EClassId]:
         """
-        Not sure I've got rebuilding down solid yet.
+        Fix up the hash-cons entries of the parents of `a` and merge
+        the ones which became congruent. Returns the e-classes whose
+        node lists may now hold stale or duplicate nodes, and adds the
+        nodes put in the hash-cons to `inserted`.
 
         It is the caller's responsibility to pass a canonical e-class id.
         """
         e = self.classes[a]
+        dirty = {a}
 
         # Fix the hash-cons
         for (n, b) in e.parents:
-            try:
-                self.hash_cons.pop(n)
-            except:
-                pass
-            self.hash_cons[self.canonicalize(n)] = self.find(b)
+            self.hash_cons.pop(n, None)
+            self.operator_nodes[n.operator].discard(n)
+            n = self.canonicalize(n)
+            self.hash_cons[n] = self.find(b)
+            self.operator_nodes[n.operator].add(n)
+            inserted.add(n)
 
-        # Upward merge
+        # Upward merge. Parents which are the same node once
+        # canonicalized collapse into a single entry.
+        k = len(e.parents)
         parents = dict()
-        did_union = False
-        for (n, b) in e.parents:
+        for (n, b) in e.parents[:k]:
             n = self.canonicalize(n)
-            if c := parents.get(n):
+            if (c := parents.get(n)) is not None:
                 self.union(b, c)
-                did_union = True
             parents[n] = self.find(b)
-        self.classes[a].parents = list(parents.items())
+            dirty.add(b)
+        # The unions above can move more parents into `a`, or `a`
+        # into another e-class. Either way it's back on the worklist,
+        # so whatever they brought gets deduplicated next pass.
+        if self.find(a) == a:
+            e.parents = list(parents.items()) + e.parents[k:]
+
+        # The data of `a` came from a union, let the analysis act on it
+        self.analysis.modify(self, self.find(a))
+        return dirty
+
+    def prune(self, a: EClassId, keep: Callable[[ENode], bool]):
+        """
+        Remove the nodes of the e-class `a` which `keep` rejects, so
+        `ematch` doesn't look at them anymore. They're still in the
+        hash-cons (and the relations of `ematch_join`), so adding one
+        of them again finds `a`.
+        """
+        a = self.find(a)
+        e = self.classes[a]
+        nodes = [n for n in e.nodes if keep(n)]
+        if len(nodes) == len(e.nodes):
+            return
+        for f in { n.operator for n in e.nodes } - { n.operator for n in nodes }:
+            self.operators[f].discard(a)
+        self.node_count -= len(e.nodes) - len(nodes)
+        e.nodes = nodes
 
     # Efficient E-matching for SMT Solvers Figure 1 p. 186
     #
@@ -246,6 +1028,139 @@ class EGraph:
                     if f == n.operator and len(ps) == len(n.operands)
                 )))
 
+    def run_program(self, q: Program, a: EClassId, constants: list[EClassId] | None = None) -> list[tuple[Slots, EClassId | Extension]]:
+        """
+        Run the compiled program `q` with its root register set to the
+        e-class `a`, returning the slots and root of each match it
+        yields. The root is `a`, unless an AC pattern matched part of
+        a node. `constants` are the e-classes of the program's ground
+        subterms, from `resolve`.
+
+        Gives the same matches as `ematch_at(p, a, {pmap()})` for the
+        pattern `p` that `q` was compiled from.
+        """
+        if constants is None:
+            constants = self.resolve(q)
+            if constants is None:
+                return []
+        registers = [0] * q.size
+        registers[0] = self.find(a)
+        S = list()
+        self._run(q.instructions, 0, registers, constants, S)
+        return S
+
+    def _run(self, instructions: tuple[Instruction, ...], pc: int, registers: list[EClassId], constants: list[EClassId], S: list[tuple[Slots, EClassId | Extension]]):
+        while True:
+            match instructions[pc]:
+                case Bind(i, f, k, out):
+                    for n in self.classes[registers[i]].nodes:
+                        if n.operator == f and len(n.operands) == k:
+                            for j, b in enumerate(n.operands):
+                                registers[out + j] = self.find(b)
+                            self._run(instructions, pc + 1, registers, constants, S)
+                    # Every way forward was explored by the recursive calls
+                    return
+                case BindAC(i, f, k, out, rest, extend):
+                    a = registers[i]
+                    for n in self.classes[a].nodes:
+                        if n.operator == f and len(n.operands) >= k:
+                            for bs in self.assignments(n, k, rest):
+                                registers[out:out + k] = bs
+                                self._run(instructions, pc + 1, registers, constants, S)
+                            if extend and len(n.operands) > k:
+                                # The root register isn't read again,
+                                # so it can hold the real root
+                                for bs, x in self.extensions(n, k, a):
+                                    registers[out:out + k] = bs
+                                    registers[i] = x
+                                    self._run(instructions, pc + 1, registers, constants, S)
+                                registers[i] = a
+                    return
+                case Compare(i, j):
+                    if registers[i] != registers[j]:
+                        return
+                    pc += 1
+                case Yield(_, rs):
+                    S.append((tuple([registers[r] for r in rs]), registers[0]))
+                    return
+                case CompareGround(i, k):
+                    if registers[i] != constants[k]:
+                        return
+                    pc += 1
+
+    def assignments(self, n: ENode, k: int, rest: tuple[int, ...]) -> list[tuple[EClassId | ENode, ...]]:
+        """
+        The ways to match the `k` operands of an AC pattern against the
+        (canonical) operands of the node `n`, one operand each. If `n`
+        has more operands than that, one of the pattern operands at the
+        offsets in `rest` gets the rest of them instead: the e-class of
+        their sum, or if there isn't one yet, the node for it, to be
+        added if the match is applied.
+
+        Only one operand takes the rest, so there are polynomially many
+        ways in the number of operands of `n`, rather than one for every
+        way of splitting them up.
+        """
+        operands = sorted([self.find(b) for b in n.operands])
+        if len(operands) == k:
+            # Repeated operands give the same order more than once
+            return list(dict.fromkeys(permutations(operands)))
+        ways = dict()
+        for r in rest:
+            for chosen in permutations(range(len(operands)), k - 1):
+                left = set(chosen)
+                m = n.with_operands(tuple(b for j, b in enumerate(operands) if j not in left))
+                c = self.hash_cons.get(m)
+                bs = [operands[j] for j in chosen]
+                bs.insert(r, m if c is None else self.find(c))
+                ways[tuple(bs)] = None
+        return list(ways)
+
+    def extensions(self, n: ENode, k: int, a: EClassId) -> list[tuple[tuple[EClassId, ...], Extension]]:
+        """
+        The ways to match the `k` operands of an AC pattern against
+        some of the operands of the node `n` in the e-class `a`, one
+        operand each, with the root of the match for each.
+        """
+        operands = sorted([self.find(b) for b in n.operands])
+        ways = dict()
+        for chosen in permutations(range(len(operands)), k):
+            bs = tuple(operands[j] for j in chosen)
+            m = n.with_operands(tuple(sorted(bs)))
+            rest = tuple(b for j, b in enumerate(operands) if j not in chosen)
+            ways[bs, Extension(a, m, rest)] = None
+        return list(ways)
+
+    def extend(self, x: Extension) -> EClassId:
+        """
+        Add the node of the partial AC match `x`, and its sum with the
+        rest of the operands to the e-class it came from. Returns the
+        e-class of the node.
+        """
+        b = self.add(x.node)
+        self.union(x.a, self.add(x.node.with_operands((b, *x.rest))))
+        return self.find(b)
+
+    def resolve(self, q: Program, ground: dict[Template, EClassId | None] | None = None) -> list[EClassId] | None:
+        """
+        Look up the e-classes of the ground subterms of `q` in the
+        hash-cons, or return `None` if one of them isn't in the
+        e-graph, in which case `q` can't match anything.
+
+        Lookups are remembered in `ground` if it's passed, so they're
+        shared between programs.
+        """
+        if ground is None:
+            ground = dict()
+        constants = list()
+        for t in q.ground:
+            if t not in ground:
+                ground[t] = self.lookup(t, ())
+            if ground[t] is None:
+                return None
+            constants.append(ground[t])
+        return constants
+
     # De Moura and Bjorner (section 1.2, p. 185) write: "The set of
     # relevant substitutions for a pattern p can be obtained by taking
     # $\bigcup_{t \in E} match(p, t, \emptyset)$."  But shouldn't it
@@ -253,14 +1168,199 @@ class EGraph:
     # see any to ever match a variable, as the rule for pattern
     # variables returns set builders over $S$. Doing it this way seems
     # to work.
-    def ematch(self, p: Pattern) -> list[tuple[Substitution, EClassId]]:
+    def ematch(self, p: Pattern, q: Program | None = None, roots: set[EClassId] | None = None, ground: dict[Template, EClassId | None] | None = None) -> list[tuple[Slots, EClassId]]:
         """
         Find nodes in the e-graph which match the pattern `p`. For
-        each match, return a substitution which maps pattern variables
-        to e-class ids and the e-class id of the node which matched.
+        each match, return the e-class ids bound to the pattern
+        variables, in the slot order of `pattern_variables(p)`, and the
+        e-class id of the node which matched.
+
+        Pass the compiled program `q` for `p` (e.g. `plan(r)` for a
+        rule `r`) to avoid compiling the pattern again. It has to be
+        compiled for the commutative operators of this e-graph, which
+        `Rule.program` isn't. The rest of an AC match which isn't in
+        the e-graph yet is returned as a node (see `assignments`), and
+        the root of a match of part of an AC node as an `Extension`. If `roots` is given, only
+        matches rooted at those (canonical) e-classes are returned.
+        `ground` caches the e-classes of ground subterms, see
+        `resolve`.
         """
+        if q is None:
+            q = compile_pattern(p, ac=self.ac, commutative=self.commutative)
+        # A ground subterm that isn't in the e-graph means there's
+        # nothing to match, and we don't have to look
+        constants = self.resolve(q, ground)
+        if constants is None:
+            return []
+        candidates = self.roots(q, constants)
+        if roots is not None:
+            candidates = [a for a in candidates if a in roots]
+        ms = list()
+        for a in candidates:
+            ms.extend(self.run_program(q, a, constants))
+        # Deduplicate once for the whole pattern. On a rebuilt e-graph
+        # there's nothing to remove, but between rebuilds two stale
+        # nodes can still yield the same match.
+        return list(dict.fromkeys(ms))
+
+    def relevant(self, r: Rule) -> bool:
+        """
+        Whether every operator on the left-hand side of `r` is in some
+        e-class. If one isn't, `r` can't match anything.
+        """
+        return all(self.operators.get(f) for f in r.operators)
+
+    def cardinality(self, f: str) -> int:
+        """
+        The number of nodes with the operator `f`.
+        """
+        return len(self.operator_nodes.get(f, ()))
+
+    def plan(self, r: Rule) -> Program:
+        """
+        The program for the left-hand side of `r`, with its subterms
+        ordered for the e-graph as it is now (see `compile_pattern`).
+        Print it with `Program.explain`.
+
+        The plan is kept until the node count for one of the rule's
+        operators changes by about a factor of two.
+        """
+        buckets = tuple(self.cardinality(f).bit_length() for f in r.operators)
+        plan = self.plans.get(id(r))
+        if plan is not None and plan[0] == buckets:
+            return plan[1]
+        # Plan with the buckets rather than the exact counts, so the
+        # plan only depends on what we check to reuse it
+        bucket = dict(zip(r.operators, buckets))
+        q = compile_pattern(r.left, bucket.__getitem__, self.ac, self.commutative)
+        self.plans[id(r)] = (buckets, q)
+        return q
+
+    def roots(self, q: Program, constants: list[EClassId] = ()) -> list[EClassId]:
+        """
+        The e-classes the program `q` could possibly match at. If the
+        program starts with a `Bind`, only e-classes with a node for
+        its operator are worth running it against, and if the whole
+        pattern is ground, only its own e-class.
+        """
+        match q.instructions[0]:
+            case Bind(_, f, _, _) | BindAC(_, f, _, _, _):
+                return list(self.operators.get(f, ()))
+            case CompareGround(_, k):
+                return [constants[k]]
+            case _:
+                return list(self.classes.keys())
+
+    def relation(self, f: str, k: int) -> list[tuple[EClassId, ...]]:
+        """
+        The rows `(a, b_1, ..., b_k)` for every node `f(b_1, ..., b_k)`
+        in e-class `a`, all canonical.
+        """
+        return list({
+            (self.find(self.hash_cons[n]), *(self.find(b) for b in n.operands))
+            for n in self.operator_nodes.get(f, ())
+            if len(n.operands) == k
+        })
+
+    def ematch_join(self, p: Pattern, q: Query | None = None, relations: dict | None = None, roots: set[EClassId] | None = None) -> list[tuple[Slots, EClassId]]:
+        """
+        Same as `ematch`, but answers the pattern as a conjunctive
+        query over per-operator relations with generic join.
+
+        The relations are built on demand and stored in `relations`
+        if it's passed, so several patterns matched against the same
+        e-graph can share them. `roots` restricts the root e-class as
+        for `ematch`.
+
+        Commutative operators aren't supported.
+        """
+        if self.commutative & set(pattern_operators(p)):
+            raise ValueError("generic join can't match commutative operators")
+        if q is None:
+            q = compile_query(p)
+        if relations is None:
+            relations = dict()
+
+        if not q.atoms:
+            # A bare pattern variable matches every e-class
+            return [((a,), a) for a in self.classes.keys() if roots is None or a in roots]
+
+        # With the roots restricted, bind the root first so the
+        # restriction prunes as early as it can
+        order = q.order if roots is None else (q.root, *(v for v in q.order if v != q.root))
+        position = { v: i for i, v in enumerate(order) }
+
+        # Build a trie for each atom with its variables nested in the
+        # global variable order. A variable repeated within one atom
+        # (like `x` in `/(v0, x, x)`) is checked here and only
+        # appears in the trie once.
+        tries = list()
+        for atom in q.atoms:
+            key = (atom.operator, len(atom.variables) - 1)
+            if key not in relations:
+                relations[key] = self.relation(*key)
+            vs = sorted(set(atom.variables), key=position.get)
+            trie = dict()
+            for row in relations[key]:
+                binding = dict()
+                if any(binding.setdefault(v, b) != b for v, b in zip(atom.variables, row)):
+                    continue
+                t = trie
+                for v in vs:
+                    t = t.setdefault(binding[v], dict())
+            tries.append((trie, vs))
+
+        # For each variable, the atoms it appears in, as indexes into
+        # `tries`
+        occurs = [[i for i, (_, vs) in enumerate(tries) if v in vs] for v in range(len(order))]
+
+        ms = list()
+        binding = [0] * len(order)
+        cursors = [trie for trie, _ in tries]
+
+        def join(d: int):
+            if d == len(order):
+                s = tuple([binding[v] for v in q.slots])
+                ms.append((s, binding[q.root]))
+                return
+            v = order[d]
+            tables = sorted((cursors[i] for i in occurs[v]), key=len)
+            if v == q.root and roots is not None:
+                tables.insert(0, roots)
+            for b in tables[0]:
+                if all(b in t for t in tables[1:]):
+                    binding[v] = b
+                    saved = [cursors[i] for i in occurs[v]]
+                    for i in occurs[v]:
+                        cursors[i] = cursors[i][b]
+                    join(d + 1)
+                    for i, c in zip(occurs[v], saved):
+                        cursors[i] = c
+
+        join(0)
+        return ms
+
+    def ancestors(self, delta: set[EClassId], k: int) -> set[EClassId]:
+        """
+        The canonical e-classes at most `k` parent edges above some
+        e-class in `delta`.
+        """
+        seen = { self.find(a) for a in delta }
+        frontier = seen
+        for _ in range(k):
+            frontier = { self.find(b) for a in frontier for _, b in self.classes[a].parents } - seen
+            seen |= frontier
+        return seen
+
+    def ematch_reference(self, p: Pattern) -> list[tuple[Slots, EClassId]]:
+        """
+        Same as `ematch`, but uses the recursive matcher `ematch_at`
+        instead of the compiled program. Slow, but easy to trust, and
+        knows nothing about commutative operators.
+        """
+        xs = pattern_variables(p)
         return list(chain.from_iterable((
-            ((s, a) for s in self.ematch_at(p, a, {pmap()}))
+            ((tuple(s[x] for x in xs), a) for s in self.ematch_at(p, a, {pmap()}))
             for a in self.classes.keys()
         )))
 
@@ -272,46 +1372,227 @@ class EGraph:
     # even in the e-graph yet, we have to add them before
     # we can we refer to the as nodes in a particular
     # e-class.
-    def substitute_add(self, p: Pattern, s: Substitution) -> EClassId:
-        match p:
-            case PatternVariable(x):
-                return s[x]
-            case PatternTerm(f, ps):
-                return self.add(ENode(f, tuple((self.substitute_add(p, s) for p in ps))))
+    def substitute_add(self, t: Template, s: Slots) -> EClassId:
+        """
+        Add the right-hand side template `t` (see `Rule.template`)
+        with its slots filled in from `s`.
+        """
+        if isinstance(t, int):
+            return s[t]
+        (f, ts) = t
+        return self.add(ENode(f, tuple([self.substitute_add(u, s) for u in self.template_operands(t)])))
+
+    def template_operands(self, t: Template) -> tuple[Template, ...]:
+        """
+        The operands of the template `t`, flattened like those of
+        `term_operands`.
+        """
+        (f, ts) = t
+        if f not in self.ac:
+            return ts
+        us = list()
+        for u in ts:
+            if not isinstance(u, int) and u[0] == f:
+                us.extend(self.template_operands(u))
+            else:
+                us.append(u)
+        return tuple(us)
+
+    def lookup(self, t: Template, s: Slots) -> EClassId | None:
+        """
+        The e-class of the template `t` with its slots filled in from
+        `s`, if it's already in the e-graph. Never adds anything.
+        """
+        if isinstance(t, int):
+            return self.find(s[t])
+        (f, ts) = t
+        bs = list()
+        for u in self.template_operands(t):
+            b = self.lookup(u, s)
+            if b is None:
+                return None
+            bs.append(b)
+        if f in self.commutative:
+            bs.sort()
+        n = ENode(f, tuple(bs))
+        if n in self.hash_cons:
+            return self.find(self.hash_cons[n])
+        return None
 
     def count_nodes(self) -> int:
         """
-        Count the total number of nodes in the e-graph.
+        Count the total number of nodes in the e-graph. Nodes which
+        only became equal since the last `rebuild` are still counted
+        twice.
+        """
+        return self.node_count
+
+    def reset_search(self):
+        """
+        Forget which rules have been searched, so the next `search`
+        matches every rule against the whole e-graph. Call this before
+        starting a new run with `search`.
+        """
+        # Maps the id of each rule to the last iteration it was searched
+        self.searched = dict()
+        # Maps iterations to the e-classes touched before them
+        self.deltas = dict()
+
+    def search(self, i: int, rs: list[Rule], scheduler: SimpleScheduler, engine: str = "machine", incremental: bool = True) -> list[tuple[Rule, Slots, EClassId]]:
+        """
+        The search phase of iteration `i` of `run`: find the matches
+        of every rule in `rs` that `scheduler` lets through.
+
+        `engine` picks the e-matcher: "machine" for the compiled
+        programs of `ematch`, or "join" for the generic join of
+        `ematch_join`.
+
+        With `incremental`, a rule which was searched before only
+        looks for matches which touch an e-class that changed since
+        then (semi-naive evaluation).
+
+        Rules which mention an operator the e-graph doesn't have are
+        skipped without asking the scheduler, and listed in
+        `irrelevant`.
+        """
+        # Semi-naive evaluation, as in Datalog. A match that doesn't
+        # look at any e-class which changed since a rule was last
+        # searched was already found (and applied) back then, so it is
+        # enough to match at roots within `Rule.depth` parent edges of
+        # a changed e-class. Applying an old match again would only
+        # union two e-classes which are already equal anyway.
+        #
+        # Rules the scheduler skips don't count as searched, so their
+        # deltas keep piling up until they are. The same goes for rules
+        # skipped because one of their operators is missing, so once a
+        # node with it is added they're searched for everything they
+        # could have missed.
+        self.deltas[i] = self.touched
+        self.touched = set()
+
+        # Rules searched in the same iteration with patterns of the
+        # same depth share their roots
+        candidates = dict()
+        def roots(r: Rule) -> set[EClassId] | None:
+            j = self.searched.get(id(r))
+            if not incremental or j is None:
+                return None
+            if (j, r.depth) not in candidates:
+                delta = set().union(*(self.deltas[t] for t in range(j+1, i+1)))
+                candidates[(j, r.depth)] = self.ancestors(delta, r.depth)
+            return candidates[(j, r.depth)]
+
+        # Shared between the rules searched this iteration: relations
+        # for generic join, and the e-classes of ground subterms for
+        # the machine
+        relations = dict()
+        ground = dict()
+        def search(r: Rule) -> list[tuple[Slots, EClassId]]:
+            match engine:
+                case "machine":
+                    return self.ematch(r.left, self.plan(r), roots(r), ground)
+                case "join":
+                    return self.ematch_join(r.left, r.query, relations, roots(r))
+                case _:
+                    raise ValueError(f"unknown e-matching engine {engine!r}")
+
+        ms = list()
+        self.irrelevant = list()
+        for r in rs:
+            if not self.relevant(r):
+                self.irrelevant.append(r)
+                continue
+            found = scheduler.search_rule(i, r, lambda: search(r))
+            if found is None:
+                continue
+            self.searched[id(r)] = i
+            ms.extend((r, s, a) for (s, a) in found)
+
+        # Forget the deltas every rule has already seen
+        if self.searched:
+            oldest = min(self.searched.values())
+            for t in [t for t in self.deltas if t <= oldest]:
+                del self.deltas[t]
+
+        return ms
+
+    def apply(self, ms: list[tuple[Rule, Slots, EClassId]]) -> ApplyReport:
+        """
+        The apply phase of `run`: add the right-hand side of each
+        match and union it with the e-class that matched.
+
+        Matches are canonicalized and deduplicated first, then checked
+        against the rule's guard, and a right-hand side which is
+        already in the e-graph is looked up instead of added. If it's already in the matched e-class, the
+        match is skipped entirely. The unions are all done at the end,
+        leaving a single `rebuild` to the caller.
         """
-        return sum((len(e.nodes) for e in self.classes.values()))
+        seen = set()
+        unions = list()
+        duplicates = 0
+        present = 0
+        rejected = 0
+        for (r, s, a) in ms:
+            if isinstance(a, Extension):
+                a = self.extend(a)
+            a = self.find(a)
+            if self.ac:
+                # The rest of an AC match might not be in the e-graph
+                s = tuple([self.add(b) if isinstance(b, ENode) else self.find(b) for b in s])
+            else:
+                s = tuple([self.find(b) for b in s])
+            if (id(r), s, a) in seen:
+                duplicates += 1
+                continue
+            seen.add((id(r), s, a))
+
+            if r.guard is not None and not r.guard(r.substitution(s), self):
+                rejected += 1
+                continue
+
+            if r.applier is not None:
+                b = r.applier(r.substitution(s), self)
+                if b is not None:
+                    unions.append((a, b))
+                continue
+
+            b = self.lookup(r.template, s)
+            if b == a:
+                present += 1
+                continue
+            if b is None:
+                b = self.substitute_add(r.template, s)
+            unions.append((a, b))
 
-    def run(self, rs: list[Rule], l: int = 1_000_000) -> int:
+        for a, b in unions:
+            self.union(a, b)
+
+        return ApplyReport(len(ms), duplicates, present, rejected, len(unions))
+
+    def run(self, rs: list[Rule], l: int = 1_000_000, engine: str = "machine", incremental: bool = True, scheduler: SimpleScheduler | None = None) -> int:
         """
         This week on Yankee and The Brave
+
+        See `search` for `engine` and `incremental`. The `scheduler`
+        decides which rules are searched and applied each iteration,
+        and defaults to a `BackoffScheduler`.
         """
         # The e-graph is "saturated" when we reach a fixed point, in
         # the sense that running the rules doesn't add any new nodes.
         # Since we never remove anything, it is sufficient to check
-        # the total node count.
+        # the total node count. Unless the scheduler held some rules
+        # back, in which case they get another chance.
+        if scheduler is None:
+            scheduler = BackoffScheduler()
+        self.reset_search()
 
         for i in range(1, l+1):
             k = self.count_nodes()
-            ms = list(chain.from_iterable((
-                ((r, s, a) for (s, a) in self.ematch(r.left))
-                for r in rs
-            )))
-                    
-            for (r, s, a) in ms:
-                b = self.substitute_add(r.right, s)
-                # match substitute(r.right, s):
-                #     case EClassId() as _b:
-                #         b = _b
-                #     case ENode() as n:
-                #         b = self.add(n)
-                self.union(a, b)
+            ms = self.search(i, rs, scheduler, engine, incremental)
+            self.apply(ms)
             self.rebuild()
 
-            if k == self.count_nodes():
+            if k == self.count_nodes() and scheduler.can_stop(i):
                 return i
 
         return l
@@ -4,7 +4,8 @@ from functools import reduce
 from itertools import chain
 from pprint import pprint
 from pyrsistent import pmap
-from sympy import Expr, Symbol, Integer, reduced, symbols, groebner
+from groebner import GroebnerBasis
+from sympy import Expr, Symbol, Integer, symbols
 from typing import Mapping
 
 EClassId = Symbol
@@ -46,20 +47,19 @@ class Rule:
 
 @dataclass
 class EGraph:
-    basis: list[Expr]
+    basis: GroebnerBasis
     ids: list[EClassId]
     hash_cons: dict[ENode, EClassId]
     classes: dict[Expr, list[ENode]]
 
     def __init__(self):
-        self.basis = list()
+        self.basis = GroebnerBasis()
         self.ids = list()
         self.hash_cons = dict()
         self.classes = dict()
 
     def find(self, a: EClassId) -> EClassId:
-        qs, r = reduced(a, self.basis, *self.ids)
-        return r
+        return self.basis.reduce(a)
 
     def canonicalize(self, n: ENode) -> ENode:
         return ENode(n.operator, tuple((self.find(a) for a in n.operands)))
@@ -87,6 +87,7 @@ class EGraph:
                     k = len(self.ids)
                     a = symbols(f"e{k}")
                     self.ids.append(a)
+                    self.basis.add_generators([a])
                     self.hash_cons[n] = a
                         
                     # Okay, now some weird shit
@@ -124,8 +125,8 @@ class EGraph:
         if a == b:
             return a
         else:
-            self.basis.append(a - b)
-            self.basis = list(groebner(self.basis, *self.ids))
+            # Only the new equation's S-pairs need reducing
+            self.basis.add([a - b])
             assert(self.find(a) == self.find(b))
             return self.find(a)
 
@@ -137,8 +138,8 @@ class EGraph:
     def rebuild(self):
         i = 0
         while True:
-            self.basis = list(groebner(self.basis, *self.ids))
-        
+            # `_union` keeps the basis up to date, no need to compute
+            # it again here
             hash_cons = dict()
             for n, a in self.hash_cons.items():
                 n = self.canonicalize(n)
@@ -3,8 +3,9 @@ from dataclasses import dataclass
 from functools import reduce
 from itertools import chain
 from pyrsistent import pmap
-from sympy import Expr, Integer, Symbol, symbols, reduced, groebner
-from typing import Mapping
+from groebner import GroebnerBasis
+from sympy import Expr, Integer, Symbol, symbols
+from typing import Callable, Mapping
 
 EClassId = Symbol
 
@@ -22,7 +23,7 @@ class ENode:
 
 @dataclass
 class EGraph:
-    basis: list[Expr]
+    basis: GroebnerBasis
     ids: list[EClassId]
     hash_cons: dict[ENode, EClassId]
     classes: dict[Expr, list[ENode]]
@@ -40,33 +41,39 @@ Pattern = PatternTerm | PatternVariable
 
 Substitution = Mapping[PatternVariable, EClassId]
 
+# Same as `Rule` in the non-frankenstein-monster e-graph: `guard`
+# filters matches before anything is added, and `applier` replaces
+# `right` for rules which can't be written as a pattern
 @dataclass(frozen=True)
 class Rule:
     left: Pattern
-    right: Pattern
+    right: Pattern | None = None
+    guard: Callable[[Substitution, EGraph], bool] | None = None
+    applier: Callable[[Substitution, EGraph], EClassId | None] | None = None
 
-@dataclass(frozen=True)
-class RuleConditional:
-    left: Pattern
-    right: Pattern
-    predicate: Callable[[Substitution, EGraph], bool]
+    def __post_init__(self):
+        if (self.right is None) == (self.applier is None):
+            raise ValueError("a rule needs exactly one of a right-hand side and an applier")
 
 @dataclass
 class EGraph:
-    basis: list[Expr]
+    basis: GroebnerBasis
+    # Equations from unions which haven't gone into the basis yet. The
+    # next `rebuild` adds them all in one update.
+    pending: list[Expr]
     ids: list[EClassId]
     hash_cons: dict[ENode, EClassId]
     classes: dict[EClassId, list[ENode]]
 
     def __init__(self):
-        self.basis = list()
+        self.basis = GroebnerBasis()
+        self.pending = list()
         self.ids = list()
         self.hash_cons = dict()
         self.classes = dict()
 
     def find(self, a: EClassId) -> EClassId:
-        qs, r = reduced(a, self.basis, *self.ids)
-        return r
+        return self.basis.reduce(a)
 
     def canonicalize(self, n: ENode) -> ENode:
         return ENode(n.operator, tuple((self.find(a) for a in n.operands)))
@@ -79,6 +86,7 @@ class EGraph:
             k = len(self.ids)
             a = symbols(f"e{k}")
             self.ids.append(a)
+            self.basis.add_generators([a])
             self.hash_cons[n] = a
 
             match n:
@@ -122,13 +130,14 @@ class EGraph:
         if a == b:
             return a
         else:
-            self.basis.append(a - b)
+            self.pending.append(a - b)
             return self.find(a)
 
     def rebuild(self):
         while True:
-            self.basis = list(groebner(self.basis, *self.ids))
-        
+            self.basis.add(self.pending)
+            self.pending = list()
+
             hash_cons = dict()
             for n, a in list(self.hash_cons.items()):
                 n = self.canonicalize(n)
@@ -139,7 +148,7 @@ class EGraph:
                 else:
                     c = self.find(a)
                 hash_cons[n] = c
-            if self.hash_cons == hash_cons:
+            if self.hash_cons == hash_cons and not self.pending:
                 break
             else:
                 self.hash_cons = hash_cons
@@ -186,3 +195,46 @@ class EGraph:
                 return s[x]
             case PatternTerm(f, ps):
                 return self.add(ENode(f, tuple((self.substitute_add(p, s) for p in ps))))
+
+    # Hooks for `runner.Runner`, see the methods of the same names in
+    # the non-frankenstein-monster e-graph
+    def reset_search(self):
+        pass
+
+    def search(self, i: int, rs: list[Rule], scheduler) -> list[tuple[Rule, Substitution, EClassId]]:
+        ms = list()
+        for r in rs:
+            found = scheduler.search_rule(i, r, lambda: self.ematch(r.left))
+            if found is not None:
+                ms.extend((r, s, a) for (s, a) in found)
+        return ms
+
+    def apply(self, ms: list[tuple[Rule, Substitution, EClassId]]):
+        for (r, s, a) in ms:
+            if r.guard is not None and not r.guard(s, self):
+                continue
+            if r.applier is not None:
+                b = r.applier(s, self)
+                if b is None:
+                    continue
+            else:
+                b = self.substitute_add(r.right, s)
+            self.union(a, b)
+
+    def run(self, rs: list[Rule], l: int = 1_000_000) -> int:
+        """
+        Apply every rule in `rs` until nothing changes, for at most
+        `l` iterations. Use `runner.Runner` for limits and goals.
+        """
+        for i in range(1, l+1):
+            k = self.count_nodes()
+            ms = list()
+            for r in rs:
+                ms.extend((r, s, a) for (s, a) in self.ematch(r.left))
+            self.apply(ms)
+            self.rebuild()
+
+            if k == self.count_nodes():
+                return i
+
+        return l
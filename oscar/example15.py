@@ -1,4 +1,6 @@
 from egraph_buddo4 import *
+from rules4 import multiply_inverse_equal_one
+from runner import Runner, StopReason
 
 import sympy
 
@@ -69,30 +71,12 @@ fifth_id = ids[-4]
 
 print(g.find(first_id), g.find(second_id), g.find(third_id))
 
-for i in range(1, 1+1):
-    print(f"iteration {i}")
-    for a, ns in g.classes.items():
-        print(f"{a}:")
-        for n in ns:
-            print(f"  {n}")
-    k = g.count_nodes()
-    for a in g.classes.keys():
-        a = g.find(a)
-
-        # x != 0 => x * x^-1 = 1
-        if a != 0:
-            b = g.add(ENode("^-1", [a]))
-            c = g.add(ENode("*", [a, b]))
-            g.union(c, 1)
-    g.rebuild()
-
-    if k == g.count_nodes():
-        print(f"saturated after {i} iterations")
-        break
-    if g.find(first_id) == g.find(second_id) \
-       and g.find(second_id) == g.find(third_id):
-        print(f"breaking early on iteration {i}")
-        break
+report = Runner(g, [multiply_inverse_equal_one], iteration_limit=1, time_limit=600.0, goals=[(first_id, second_id), (second_id, third_id)]).run()
+match report.stop_reason:
+    case StopReason.SATURATED:
+        print(f"saturated after {report.iterations} iterations")
+    case StopReason.GOAL:
+        print(f"breaking early on iteration {report.iterations}")
 
 for a, ns in g.classes.items():
     print(f"{a}:")
@@ -0,0 +1,306 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from heapq import heappush, heappop
+from itertools import count
+from typing import Callable
+from egraph import *
+
+# A cost function gets a node and the costs of the best terms for each
+# of its operands, in order, and returns the cost of the best term
+# rooted at that node.
+#
+# Extraction is only optimal for cost functions which never make a
+# term cheaper than one of its subterms (they're "monotone"), like
+# all of the ones below. That's what lets us settle e-classes in
+# order of cost, the same way Dijkstra settles vertices.
+CostFunction = Callable[[ENode, list[float]], float]
+
+def ast_size(n: ENode, costs: list[float]) -> float:
+    """
+    Count the nodes in the term.
+    """
+    return 1 + sum(costs)
+
+def ast_depth(n: ENode, costs: list[float]) -> float:
+    """
+    Count the nodes on the longest path from the root to a leaf.
+    """
+    return 1 + max(costs, default=0)
+
+def operator_weights(weights: dict[str, float], default: float = 1) -> CostFunction:
+    """
+    Like `ast_size`, but each node costs the weight of its operator
+    (or `default` if there's none) instead of 1.
+    """
+    def cost(n: ENode, costs: list[float]) -> float:
+        return weights.get(n.operator, default) + sum(costs)
+    return cost
+
+class Extractor:
+    """
+    Finds the cheapest term in every e-class of a rebuilt e-graph
+    according to the cost function `cost`.
+
+    The best costs are computed up front, so the e-graph shouldn't
+    change while the extractor is in use.
+    """
+    def __init__(self, egraph: EGraph, cost: CostFunction = ast_size):
+        self.egraph = egraph
+        self.cost = cost
+        # Maps canonical e-class ids to the cost of their best term
+        # and the node at its root
+        self.best_cost = dict()
+        self.best_node = dict()
+        self.terms = dict()
+        self.compute()
+
+    def compute(self):
+        # Knuth's generalization of Dijkstra's algorithm. A node is
+        # ready once every one of its operands has a best cost, at
+        # which point its own cost is known and it goes on the queue.
+        # The cheapest node on the queue settles its e-class, since
+        # every node which isn't ready yet will cost at least as much,
+        # and then its parents get one step closer to being ready.
+        #
+        # Each node is pushed at most once and each (node, operand)
+        # pair is looked at once, so this is O(n log n) in the number
+        # of nodes, and nodes on cycles just never become ready.
+        g = self.egraph
+        waiting = dict()
+        remaining = dict()
+        queue = list()
+        tiebreak = count()
+        for a, e in g.classes.items():
+            for n in e.nodes:
+                n = g.canonicalize(n)
+                operands = set(n.operands)
+                remaining[n] = len(operands)
+                if not operands:
+                    heappush(queue, (self.cost(n, []), next(tiebreak), a, n))
+                for b in operands:
+                    waiting.setdefault(b, list()).append((n, a))
+
+        while queue:
+            c, _, a, n = heappop(queue)
+            if a in self.best_cost:
+                continue
+            self.best_cost[a] = c
+            self.best_node[a] = n
+            for (m, b) in waiting.get(a, ()):
+                remaining[m] -= 1
+                if remaining[m] == 0 and b not in self.best_cost:
+                    costs = [self.best_cost[d] for d in m.operands]
+                    heappush(queue, (self.cost(m, costs), next(tiebreak), b, m))
+
+    def find_best(self, a: EClassId) -> tuple[float, Term]:
+        """
+        The cost of the best term in the e-class `a`, and the term.
+        """
+        a = self.egraph.find(a)
+        if a not in self.best_cost:
+            raise ValueError(f"e-class {a} only contains infinite terms")
+        return self.best_cost[a], self.term(a)
+
+    def term(self, a: EClassId) -> Term:
+        # Subterms are built once and shared between the terms that
+        # contain them
+        if a not in self.terms:
+            n = self.best_node[a]
+            self.terms[a] = Term(n.operator, tuple(self.term(b) for b in n.operands))
+        return self.terms[a]
+
+# Tree extraction picks the best term for each e-class on its own, so a
+# subterm which appears in several places is paid for every time. DAG
+# extraction instead picks one node per e-class for all of the roots
+# together and pays for each e-class it uses once, which is what it
+# costs to actually compute the result with the shared subterms
+# reused. Each node costs what the cost function says it costs with
+# operands that cost nothing, so `ast_size` counts e-classes and
+# `operator_weights` adds up the weights of the chosen nodes.
+#
+# Finding the cheapest DAG is NP-hard, so by default we use the greedy
+# heuristic from extraction-gym: each e-class keeps the set of
+# e-classes (with their costs) that its best node needs, and picks the
+# node whose set is cheapest. Branch-and-bound can then improve on
+# that. It's exact if it finishes within its budget.
+
+@dataclass
+class TermDag:
+    """
+    A hash-consed term DAG. The operands of each node are indexes of
+    earlier nodes, so a shared subterm is one node no matter how many
+    times it appears.
+    """
+    nodes: list[ENode]
+    roots: list[int]
+
+    def term(self, i: int) -> Term:
+        """
+        Unfold the node at index `i` into a `Term`.
+        """
+        n = self.nodes[i]
+        return Term(n.operator, tuple(self.term(j) for j in n.operands))
+
+class DagExtractor:
+    """
+    Picks a node for each e-class needed by the e-classes in `roots`,
+    trying to minimize the total cost of the DAG they form together.
+
+    With `exact`, the greedy choice is improved with branch-and-bound,
+    giving up after `budget` search steps. `optimal` says whether the
+    result was proven optimal.
+    """
+    def __init__(self, egraph: EGraph, roots: list[EClassId], cost: CostFunction = ast_size, exact: bool = False, budget: int = 100_000):
+        self.egraph = egraph
+        self.roots = [egraph.find(a) for a in roots]
+        self.cost = cost
+        # Maps canonical e-class ids to the chosen node
+        self.choice = dict()
+        self.optimal = False
+        self.greedy()
+        if exact:
+            self.branch_and_bound(budget)
+
+    def node_cost(self, n: ENode) -> float:
+        return self.cost(n, [0] * len(n.operands))
+
+    def greedy(self):
+        # Same worklist as `Extractor.compute`, but with the cost of a
+        # node being that of the union of its operands' sets. A set
+        # never gets cheaper by adding to it, so it's still safe to
+        # settle e-classes in order of cost.
+        g = self.egraph
+        waiting = dict()
+        remaining = dict()
+        queue = list()
+        tiebreak = count()
+        sets = dict()
+        for a, e in g.classes.items():
+            for n in e.nodes:
+                n = g.canonicalize(n)
+                operands = set(n.operands)
+                remaining[n] = len(operands)
+                if not operands:
+                    heappush(queue, (self.node_cost(n), next(tiebreak), a, n, { a: self.node_cost(n) }))
+                for b in operands:
+                    waiting.setdefault(b, list()).append((n, a))
+
+        while queue:
+            _, _, a, n, s = heappop(queue)
+            if a in sets:
+                continue
+            sets[a] = s
+            self.choice[a] = n
+            for (m, b) in waiting.get(a, ()):
+                remaining[m] -= 1
+                if remaining[m] == 0 and b not in sets:
+                    s = dict()
+                    for d in m.operands:
+                        s.update(sets[d])
+                    s[b] = self.node_cost(m)
+                    heappush(queue, (sum(s.values()), next(tiebreak), b, m, s))
+
+        for a in self.roots:
+            if a not in sets:
+                raise ValueError(f"e-class {a} only contains infinite terms")
+        self.choice = self.reachable(self.choice)
+
+    def reachable(self, choice: dict[EClassId, ENode]) -> dict[EClassId, ENode]:
+        """
+        Restrict `choice` to the e-classes the roots actually use.
+        """
+        used = dict()
+        stack = list(self.roots)
+        while stack:
+            a = stack.pop()
+            if a not in used:
+                used[a] = choice[a]
+                stack.extend(choice[a].operands)
+        return used
+
+    def total_cost(self) -> float:
+        """
+        The cost of the chosen DAG, paying once for each e-class.
+        """
+        return sum(self.node_cost(n) for n in self.choice.values())
+
+    def branch_and_bound(self, budget: int):
+        # Depth-first search over choices for the e-classes the roots
+        # need, starting from the greedy solution as the incumbent.
+        # The lower bound for a partial choice is its cost plus the
+        # cheapest node of every e-class it still needs, since each of
+        # those will cost at least that much and is only paid once.
+        g = self.egraph
+        options = dict()
+        cheapest = dict()
+        for a, e in g.classes.items():
+            nodes = list(dict.fromkeys(g.canonicalize(n) for n in e.nodes))
+            options[a] = sorted(nodes, key=self.node_cost)
+            cheapest[a] = self.node_cost(options[a][0])
+
+        best = self.total_cost()
+        best_choice = self.choice
+        steps = 0
+        chosen = dict()
+
+        def creates_cycle(a: EClassId, n: ENode) -> bool:
+            # Whether `a` can be reached from the operands of `n`
+            # through the nodes chosen so far
+            seen = set()
+            stack = list(n.operands)
+            while stack:
+                b = stack.pop()
+                if b == a:
+                    return True
+                if b not in seen and b in chosen:
+                    seen.add(b)
+                    stack.extend(chosen[b].operands)
+            return False
+
+        def search(todo: list[EClassId], cost: float):
+            nonlocal best, best_choice, steps
+            steps += 1
+            if steps > budget:
+                return False
+            todo = [a for a in todo if a not in chosen]
+            if not todo:
+                if cost < best:
+                    best = cost
+                    best_choice = dict(chosen)
+                return True
+            bound = cost + sum(cheapest[a] for a in set(todo))
+            if bound >= best:
+                return True
+            a, rest = todo[0], todo[1:]
+            for n in options[a]:
+                if creates_cycle(a, n):
+                    continue
+                chosen[a] = n
+                finished = search(rest + list(n.operands), cost + self.node_cost(n))
+                del chosen[a]
+                if not finished:
+                    return False
+            return True
+
+        self.optimal = search(list(dict.fromkeys(self.roots)), 0)
+        self.choice = best_choice
+
+    def dag(self) -> TermDag:
+        """
+        The chosen DAG, with the roots in the order they were given.
+        """
+        nodes = list()
+        hash_cons = dict()
+        index = dict()
+
+        def visit(a: EClassId) -> int:
+            if a not in index:
+                n = self.choice[a]
+                n = n.with_operands(tuple(visit(b) for b in n.operands))
+                if n not in hash_cons:
+                    hash_cons[n] = len(nodes)
+                    nodes.append(n)
+                index[a] = hash_cons[n]
+            return index[a]
+
+        return TermDag(nodes, [visit(a) for a in self.roots])
@@ -0,0 +1,99 @@
+from __future__ import annotations
+from heapq import heappush, heappop
+from itertools import count
+from sympy import Expr, Symbol
+from sympy.polys.domains import QQ
+from sympy.polys.groebnertools import spoly
+from sympy.polys.monomials import monomial_divides, monomial_lcm, monomial_mul
+from sympy.polys.orderings import lex
+from sympy.polys.rings import PolyRing, PolyElement
+from typing import Iterable
+
+# The Gröbner e-graphs used to add each new equation to the basis and
+# call `groebner` on the whole thing again, so every union paid for
+# the entire ideal. `GroebnerBasis` keeps the reduced basis around and
+# runs Buchberger's algorithm only on the S-pairs which involve a new
+# polynomial: the S-pairs between old elements all reduced to zero
+# the last time, and adding to the basis can't change that.
+#
+# The order is lex with the generators in the order they were added,
+# which is what `groebner(basis, *ids)` used. A new generator comes
+# last, so it's the smallest, and a basis for the old generators is
+# still a (reduced) Gröbner basis once it's added.
+
+class GroebnerBasis:
+    """
+    The reduced Gröbner basis of an ideal which only ever grows, over
+    the rationals.
+    """
+    def __init__(self, gens: Iterable[Symbol] = ()):
+        self.ring = PolyRing(tuple(gens), QQ, lex)
+        # Monic, and sorted by leading monomial
+        self.polys: list[PolyElement] = list()
+
+    def add_generators(self, gens: Iterable[Symbol]):
+        """
+        Make room for polynomials in more generators, ordered after
+        (that is, smaller than) the ones there already.
+        """
+        self.ring = PolyRing(self.ring.symbols + tuple(gens), QQ, lex)
+        self.polys = [p.set_ring(self.ring) for p in self.polys]
+
+    def exprs(self) -> list[Expr]:
+        return [p.as_expr() for p in self.polys]
+
+    def reduce(self, a: Expr) -> Expr:
+        """
+        The normal form of `a` modulo the ideal.
+        """
+        return self.ring.from_expr(a).rem(self.polys).as_expr()
+
+    def add(self, ps: Iterable[Expr]) -> bool:
+        """
+        Add the polynomials `ps` to the ideal, all in one update.
+        Returns whether the ideal changed.
+        """
+        G = list(self.polys)
+        old = len(G)
+        # S-pairs left to reduce, as indexes into `G`, cheapest least
+        # common multiple first (the "normal strategy")
+        pairs = list()
+        tiebreak = count()
+
+        def insert(h: PolyElement):
+            h = h.rem(G)
+            if not h:
+                return
+            h = h.monic()
+            for i, g in enumerate(G):
+                lcm = monomial_lcm(g.LM, h.LM)
+                # Buchberger's first criterion: the S-polynomial of two
+                # polynomials with coprime leading monomials always
+                # reduces to zero
+                if lcm != monomial_mul(g.LM, h.LM):
+                    heappush(pairs, (self.ring.order(lcm), next(tiebreak), i, len(G)))
+            G.append(h)
+
+        for p in ps:
+            insert(self.ring.from_expr(p))
+        while pairs:
+            _, _, i, j = heappop(pairs)
+            insert(spoly(G[i], G[j], self.ring))
+
+        if len(G) == old:
+            return False
+        self.polys = self.interreduce(G)
+        return True
+
+    def interreduce(self, G: list[PolyElement]) -> list[PolyElement]:
+        # A monomial is only divisible by monomials which don't come
+        # after it, so going in order, whatever could make an element
+        # redundant has already been kept
+        G = sorted(G, key=lambda g: self.ring.order(g.LM))
+        minimal = list()
+        for g in G:
+            if not any(monomial_divides(h.LM, g.LM) for h in minimal):
+                minimal.append(g)
+        # No leading monomial divides another now, so reducing each
+        # element by the rest only touches its tail
+        return [g.rem(minimal[:k] + minimal[k+1:]) for k, g in enumerate(minimal)]
@@ -1,5 +1,7 @@
 from egraph import *
 from herbie_rules import rules
+from runner import Runner
+from extract import Extractor, DagExtractor
 
 one = Term("1", tuple())
 x = Term("x", tuple())
@@ -13,28 +15,24 @@ id1 = g.add_term(one_subtract_sin_divide_cos)
 id2 = g.add_term(cos_divide_one_add_sin)
 print(g.find(id1), g.find(id2))
 g.rebuild()
-l = 20
 
-for i in range(1, l+1):
-    k = g.count_nodes()
-    ms = list(chain.from_iterable((
-        ((r, s, a) for (s, a) in g.ematch(r.left))
-        for r in rules
-    )))
-    print(f"--------------- Iteration {i} ------------------")
-    pprint({a: e.nodes for a, e in g.classes.items()})
-    pprint(ms)
-    
-    for (r, s, a) in ms:
-        b = g.substitute_add(r.right, s)
-        g.union(a, b)
-    g.rebuild()
-        
-    if k == g.count_nodes():
-        break
-    if g.find(id1) == g.find(id2):
-        break
+report = Runner(g, rules, iteration_limit=20, goals=[(id1, id2)]).run()
+for k, it in enumerate(report.history, 1):
+    print(f"--------------- Iteration {k} ------------------")
+    print(f"{it.matches} matches, {it.nodes} nodes, {it.classes} classes")
+    if it.applied is not None:
+        print(f"skipped {it.applied.duplicates} duplicate matches and {it.applied.present} already present")
+    if it.skipped:
+        print(f"skipped rules {[rules.index(r) for r in it.skipped]}, which can't match")
 
-print(f"finished after {i} iterations")
-pprint({a: e.nodes for a, e in g.classes.items()})
+print(f"finished after {report.iterations} iterations: {report.stop_reason.value}")
 print(g.find(id1), g.find(id2))
+extractor = Extractor(g)
+pprint(extractor.find_best(id1))
+pprint(extractor.find_best(id2))
+
+# Both sides share sin(x) and cos(x), which DAG extraction only pays
+# for once
+dag = DagExtractor(g, [id1, id2]).dag()
+pprint(dag.nodes)
+print(dag.roots)
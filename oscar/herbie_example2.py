@@ -18,7 +18,7 @@ l = 20
 for i in range(1, l+1):
     k = g.count_nodes()
     ms = list(chain.from_iterable((
-        ((r, s, a) for (s, a) in g.ematch(r.left))
+        ((r, s, a) for (s, a) in g.ematch(r.left, r.program))
         for r in rules
     )))
     # print(f"--------------- Iteration {i} ------------------")
@@ -26,7 +26,7 @@ for i in range(1, l+1):
     # pprint(ms)
     
     for (r, s, a) in ms:
-        b = g.substitute_add(r.right, s)
+        b = g.substitute_add(r.template, s)
         g.union(a, b)
     g.rebuild()
         
@@ -148,3 +148,15 @@ rules = [
     sin2_cos2_equal_one,
     one_minus_sin2_equal_cos2
 ]
+
+# With `+` and `*` declared associative-commutative (`EGraph(ac=ac)`),
+# the e-graph takes care of what their commutativity and associativity
+# rules did, without adding every bracketing and order of a sum
+ac = ("+", "*")
+associative_commutative = [
+    add_commutative,
+    add_associative, reverse(add_associative),
+    multiply_commutative,
+    multiply_associative, reverse(multiply_associative),
+]
+rules_ac = [r for r in rules if r not in associative_commutative]
@@ -0,0 +1,77 @@
+from __future__ import annotations
+from array import array
+from egraph import EClassId, ENode, intern_operator, operator_name
+
+class NodeStore:
+    """
+    E-nodes stored struct-of-arrays style and referred to by index.
+
+    Each node is an interned operator id, an arity and an offset into
+    one flat column of children, all in `array('q')` buffers, so a node
+    costs a few machine words instead of a Python object and a tuple.
+    Nodes are hash-consed: adding the same node twice gives the same
+    index.
+    """
+    def __init__(self):
+        self.ops = array('q')
+        self.arities = array('q')
+        self.offsets = array('q')
+        self.children = array('q')
+        # Maps node hashes to node indices. Nodes whose hash collides
+        # with an earlier, different node go in `collisions`.
+        self.by_hash = dict()
+        self.collisions = dict()
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def operator(self, i: int) -> str:
+        return operator_name(self.ops[i])
+
+    def operands(self, i: int) -> tuple[EClassId, ...]:
+        j = self.offsets[i]
+        return tuple(self.children[j:j + self.arities[i]])
+
+    def node(self, i: int) -> ENode:
+        return ENode(self.operator(i), self.operands(i))
+
+    def _equal(self, i: int, op: int, operands: tuple[EClassId, ...]) -> bool:
+        return self.ops[i] == op and self.operands(i) == operands
+
+    def lookup(self, operator: str, operands: tuple[EClassId, ...]) -> int | None:
+        """
+        The index of the node, if it has been added.
+        """
+        op = intern_operator(operator)
+        h = hash((op, operands))
+        i = self.by_hash.get(h)
+        if i is None:
+            return None
+        if self._equal(i, op, operands):
+            return i
+        for i in self.collisions.get(h, ()):
+            if self._equal(i, op, operands):
+                return i
+        return None
+
+    def add(self, operator: str, operands: tuple[EClassId, ...]) -> int:
+        """
+        Add a node, returning its index.
+        """
+        operands = tuple(operands)
+        if (i := self.lookup(operator, operands)) is not None:
+            return i
+
+        op = intern_operator(operator)
+        i = len(self.ops)
+        self.ops.append(op)
+        self.arities.append(len(operands))
+        self.offsets.append(len(self.children))
+        self.children.extend(operands)
+
+        h = hash((op, operands))
+        if h in self.by_hash:
+            self.collisions.setdefault(h, list()).append(i)
+        else:
+            self.by_hash[h] = i
+        return i
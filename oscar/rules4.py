@@ -1,5 +1,7 @@
 from egraph_buddo4 import *
 
+import sympy
+
 x = PatternVariable("x")
 y = PatternVariable("y")
 z = PatternVariable("z")
@@ -31,6 +33,40 @@ multiply_divide_equal_divide_multiply = Rule(
     PatternTerm("*", [PatternTerm("/", [x, y]), PatternTerm("/", [w, z])])
 )
 
+def nonzero(s: Substitution, g: EGraph) -> bool:
+    return g.find(s["x"]) != 0
+
+def add_inverse(s: Substitution, g: EGraph) -> None:
+    a = s["x"]
+    b = g.add(ENode("^-1", (a,)))
+    c = g.add(ENode("*", (a, b)))
+    g.union(c, 1)
+
+# x != 0 => x * x^-1 = 1
+multiply_inverse_equal_one = Rule(x, guard=nonzero, applier=add_inverse)
+
+def divisions(trivial: bool) -> Callable[[Substitution, EGraph], None]:
+    """
+    An applier which finds every e-class `y` dividing the e-class of
+    `x` exactly, with quotient `q`, and adds x / y = q and x / q = y.
+    Unless `trivial`, dividing by 1 or by `x` itself is left out.
+    """
+    def apply(s: Substitution, g: EGraph) -> None:
+        for b in list(g.classes.keys()):
+            a = g.find(s["x"])
+            b = g.find(b)
+            if not trivial and (b == 1 or a == b):
+                continue
+            q, r = sympy.div(a, b, g.ids)
+            if g.find(r) == 0:
+                q = g.find(q)
+                g.union(g.add(ENode("/", (a, b))), q)
+                g.union(g.add(ENode("/", (a, q))), b)
+    return apply
+
+divide_exact = Rule(x, applier=divisions(True))
+divide_exact_nontrivial = Rule(x, guard=lambda s, g: g.find(s["x"]) != 1, applier=divisions(False))
+
 rules = [
     divide_self_equal_one,
     divide_multiply, reverse(divide_multiply),
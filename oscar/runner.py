@@ -0,0 +1,175 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from egraph import ApplyReport, EClassId, Rule, SimpleScheduler, BackoffScheduler
+from enum import Enum
+from time import perf_counter
+from typing import Any, Callable
+
+import resource
+
+# Egg's `Runner`. `EGraph.run` only knows about an iteration limit, so
+# drivers which want to stop as soon as two terms are proven equal, or
+# before the e-graph eats the whole machine, end up copying the loop.
+# The runner wraps the same search/apply/rebuild phases and checks its
+# limits and goals between each of them.
+
+class StopReason(Enum):
+    SATURATED = "saturated"
+    ITERATION_LIMIT = "iteration limit"
+    NODE_LIMIT = "node limit"
+    TIME_LIMIT = "time limit"
+    MEMORY_LIMIT = "memory limit"
+    GOAL = "goal"
+
+# Either a predicate on the e-graph or a pair of e-classes which
+# should end up equal
+Goal = Callable[[Any], bool] | tuple[EClassId, EClassId]
+
+@dataclass
+class Iteration:
+    nodes: int
+    classes: int
+    matches: int
+    seconds: float
+    # What the apply phase did, for e-graphs which report it
+    applied: ApplyReport | None = None
+    # The rules which weren't searched because they can't match, for
+    # e-graphs which report it (see `EGraph.relevant`)
+    skipped: list[Rule] | None = None
+
+@dataclass
+class Report:
+    stop_reason: StopReason
+    # Number of iterations started, including the one that stopped
+    iterations: int
+    nodes: int
+    classes: int
+    seconds: float
+    history: list[Iteration] = field(default_factory=list)
+
+class Deadline(SimpleScheduler):
+    """
+    Wraps a scheduler so the search phase skips whatever rules are left
+    once `deadline` has passed. One big search can take much longer
+    than the rest of an iteration, so checking between phases alone
+    isn't enough.
+    """
+    def __init__(self, scheduler: SimpleScheduler, deadline: float):
+        self.scheduler = scheduler
+        self.deadline = deadline
+
+    def search_rule(self, i, r, search):
+        if perf_counter() > self.deadline:
+            return None
+        return self.scheduler.search_rule(i, r, search)
+
+    def can_stop(self, i: int) -> bool:
+        return self.scheduler.can_stop(i)
+
+class Runner:
+    """
+    Run rules on an e-graph until it saturates or some limit or goal
+    stops it. Works with any e-graph which has `search`, `apply`,
+    `rebuild`, `find`, `count_nodes` and `reset_search`.
+    """
+    def __init__(
+            self,
+            egraph,
+            rules: list[Rule],
+            iteration_limit: int = 30,
+            node_limit: int = 10_000,
+            time_limit: float = 5.0,
+            memory_limit: int | None = None,
+            goals: list[Goal] | None = None,
+            scheduler: SimpleScheduler | None = None,
+            **options
+    ):
+        """
+        `time_limit` is in seconds and `memory_limit` in bytes of peak
+        resident memory for the whole process, so it's approximate.
+        The runner stops once every goal holds. Other keyword
+        arguments are passed on to `egraph.search`.
+        """
+        self.egraph = egraph
+        self.rules = rules
+        self.iteration_limit = iteration_limit
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.goals = goals if goals is not None else list()
+        self.scheduler = scheduler if scheduler is not None else BackoffScheduler()
+        self.options = options
+
+    def done(self) -> bool:
+        """
+        Whether every goal holds.
+        """
+        def holds(goal: Goal) -> bool:
+            match goal:
+                case (a, b):
+                    return self.egraph.find(a) == self.egraph.find(b)
+                case _:
+                    return goal(self.egraph)
+        return len(self.goals) > 0 and all(holds(goal) for goal in self.goals)
+
+    def check(self, start: float, nodes: bool = True) -> StopReason | None:
+        """
+        The reason to stop now, if there is one.
+        """
+        if self.done():
+            return StopReason.GOAL
+        if nodes and self.egraph.count_nodes() > self.node_limit:
+            return StopReason.NODE_LIMIT
+        if perf_counter() - start > self.time_limit:
+            return StopReason.TIME_LIMIT
+        if self.memory_limit is not None:
+            # `ru_maxrss` is in kilobytes on Linux
+            if resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 > self.memory_limit:
+                return StopReason.MEMORY_LIMIT
+        return None
+
+    def run(self) -> Report:
+        g = self.egraph
+        g.reset_search()
+        history = list()
+        start = perf_counter()
+
+        applied = None
+        skipped = None
+
+        def record(i: int, ms: list, t: float):
+            if len(history) < i:
+                history.append(Iteration(g.count_nodes(), len(g.classes), len(ms), perf_counter() - t, applied, skipped))
+
+        def report(reason: StopReason, i: int, ms: list, t: float) -> Report:
+            # Record the iteration we stopped in, even part way through
+            record(i, ms, t)
+            return Report(reason, i, g.count_nodes(), len(g.classes), perf_counter() - start, history)
+
+        if (reason := self.check(start)) is not None:
+            return report(reason, 0, [], start)
+
+        for i in range(1, self.iteration_limit + 1):
+            t = perf_counter()
+            k = g.count_nodes()
+            applied = None
+
+            ms = g.search(i, self.rules, Deadline(self.scheduler, start + self.time_limit), **self.options)
+            skipped = getattr(g, "irrelevant", None)
+            # Searching doesn't add nodes, no need to count them
+            if (reason := self.check(start, nodes=False)) is not None:
+                return report(reason, i, ms, t)
+
+            applied = g.apply(ms)
+            if (reason := self.check(start)) is not None:
+                return report(reason, i, ms, t)
+
+            g.rebuild()
+            if (reason := self.check(start)) is not None:
+                return report(reason, i, ms, t)
+
+            if k == g.count_nodes() and self.scheduler.can_stop(i):
+                return report(StopReason.SATURATED, i, ms, t)
+            record(i, ms, t)
+
+        return report(StopReason.ITERATION_LIMIT, self.iteration_limit, [], start)
@@ -0,0 +1,29 @@
+from fractions import Fraction
+from egraph import *
+from analysis import ConstantFolding
+
+x = Term("x", tuple())
+one = Term("1", tuple())
+two = Term("2", tuple())
+
+def test_constant_folding():
+    g = EGraph(ConstantFolding())
+    a = g.add_term(Term("*", (Term("+", (one, two)), Term("/", (one, two)))))
+    g.rebuild()
+    assert(g.classes[g.find(a)].data == Fraction(3, 2))
+    assert(g.classes[g.find(a)].nodes == [ENode("3/2", tuple())])
+    assert(g.find(a) == g.find(g.add_term(Term("3/2", tuple()))))
+
+    # Division by zero doesn't fold
+    b = g.add_term(Term("/", (one, Term("-", (one, one)))))
+    g.rebuild()
+    assert(g.classes[g.find(b)].data is None)
+
+    # Finding out x = 2 flows up to x + 1 = 3 during rebuild, and x
+    # stays in its e-class next to the literal
+    c = g.add_term(Term("+", (x, one)))
+    g.union(g.add_term(x), g.add_term(two))
+    g.rebuild()
+    assert(g.find(c) == g.find(g.add_term(Term("3", tuple()))))
+    assert(set(g.classes[g.find(g.add_term(x))].nodes) == { ENode("x", tuple()), ENode("2", tuple()) })
+    assert(g.count_nodes() == sum(len(e.nodes) for e in g.classes.values()))
@@ -0,0 +1,264 @@
+from egraph import *
+from herbie_rules import rules, reverse
+
+def herbie_egraph(iterations: int) -> EGraph:
+    one = Term("1", tuple())
+    x = Term("x", tuple())
+    sin_x = Term("sin", (x,))
+    cos_x = Term("cos", (x,))
+
+    g = EGraph()
+    g.add_term(Term("/", (Term("-", (one, sin_x)), cos_x)))
+    g.add_term(Term("/", (cos_x, Term("+", (one, sin_x)))))
+    g.rebuild()
+    g.run(rules, iterations)
+    return g
+
+def test_ematch_matches_reference():
+    g = herbie_egraph(2)
+
+    for r in rules:
+        ms = g.ematch(r.left)
+        assert(len(ms) == len(set(ms)))
+        assert(set(ms) == set(g.ematch_reference(r.left)))
+
+def test_program_nonlinear_and_variable_root():
+    x = PatternVariable("x")
+    y = PatternVariable("y")
+    a = Term("a", tuple())
+    b = Term("b", tuple())
+
+    g = EGraph()
+    a_id = g.add_term(a)
+    b_id = g.add_term(b)
+    # negate(a) + a matches, negate(a) + b doesn't, and the unary
+    # negate(a, b) must be rejected by the arity check.
+    good = g.add_term(Term("+", (Term("negate", (a,)), a)))
+    g.add_term(Term("+", (Term("negate", (a,)), b)))
+    g.add_term(Term("+", (Term("negate", (a, b)), a)))
+    g.rebuild()
+
+    p = PatternTerm("+", [PatternTerm("negate", [x]), x])
+    q = compile_pattern(p)
+    assert(any(isinstance(i, Compare) for i in q.instructions))
+    assert(g.ematch(p) == [((a_id,), good)])
+    assert(set(g.ematch(p)) == set(g.ematch_reference(p)))
+
+    # A bare variable matches every e-class exactly once
+    assert(compile_pattern(x).instructions == (Yield(("x",), (0,)),))
+    assert({ a for _, a in g.ematch(x) } == set(g.classes.keys()))
+    assert(len(g.ematch(x)) == len(g.classes))
+
+    # Unioning b into a makes negate(a) + b congruent to (and so
+    # merged with) the matching class
+    bad = g.add_term(Term("+", (Term("negate", (a,)), b)))
+    g.union(a_id, b_id)
+    g.rebuild()
+    assert(g.find(bad) == g.find(good))
+    assert(g.ematch(p) == [((g.find(a_id),), g.find(good))])
+    assert(set(g.ematch(p)) == set(g.ematch_reference(p)))
+
+def test_operator_index():
+    g = herbie_egraph(2)
+
+    operators = dict()
+    for a, e in g.classes.items():
+        for n in e.nodes:
+            operators.setdefault(n.operator, set()).add(a)
+    assert({ f: s for f, s in g.operators.items() if s } == operators)
+
+    operator_nodes = dict()
+    for n in g.hash_cons.keys():
+        operator_nodes.setdefault(n.operator, set()).add(n)
+    assert({ f: s for f, s in g.operator_nodes.items() if s } == operator_nodes)
+
+def test_ematch_join_matches_reference():
+    g = herbie_egraph(2)
+
+    for r in rules:
+        ms = g.ematch_join(r.left, r.query)
+        assert(len(ms) == len(set(ms)))
+        assert(set(ms) == set(g.ematch_reference(r.left)))
+
+def canonical_nodes(g: EGraph) -> set[ENode]:
+    return { g.canonicalize(n) for e in g.classes.values() for n in e.nodes }
+
+def test_incremental_run_matches_full_run():
+    full = herbie_egraph(0)
+    full.run(rules, 2, incremental=False, scheduler=SimpleScheduler())
+    incremental = herbie_egraph(0)
+    incremental.run(rules, 2, incremental=True, scheduler=SimpleScheduler())
+
+    assert(len(full.classes) == len(incremental.classes))
+    assert(len(canonical_nodes(full)) == len(canonical_nodes(incremental)))
+
+def test_backoff_scheduler_bans_and_unbans():
+    from herbie_rules import add_commutative, add_identity_right
+
+    s = BackoffScheduler(match_limit=2, ban_length=3)
+    many = [((), a) for a in range(3)]
+    few = [((), 0)]
+
+    # Over the limit: banned for 3 iterations, and the search isn't
+    # even run while the ban lasts
+    assert(s.search_rule(1, add_commutative, lambda: many) is None)
+    assert(s.search_rule(2, add_commutative, lambda: 1 / 0) is None)
+    assert(s.search_rule(1, add_identity_right, lambda: few) == few)
+
+    # Nothing else changed the e-graph, so the ban is cut short
+    assert(not s.can_stop(2))
+    # The limit doubled after the ban
+    assert(s.search_rule(3, add_commutative, lambda: many) == many)
+    assert(s.can_stop(3))
+
+def test_runner_stops_at_goal():
+    from runner import Runner, StopReason
+
+    g = EGraph()
+    a = g.add_term(Term("+", (Term("x", tuple()), Term("0", tuple()))))
+    x = g.add_term(Term("x", tuple()))
+    g.rebuild()
+
+    report = Runner(g, rules, goals=[(a, x)]).run()
+    assert(report.stop_reason == StopReason.GOAL)
+    assert(report.iterations == 1)
+    assert(g.find(a) == g.find(x))
+
+    report = Runner(herbie_egraph(0), rules, node_limit=500).run()
+    assert(report.stop_reason == StopReason.NODE_LIMIT)
+
+def test_rebuild_deduplicates():
+    g = herbie_egraph(2)
+
+    nodes = [n for e in g.classes.values() for n in e.nodes]
+    assert(len(nodes) == len(set(nodes)))
+    assert(set(nodes) == set(g.hash_cons.keys()))
+    assert(all(g.canonicalize(n) == n for n in nodes))
+    assert(g.count_nodes() == len(g.hash_cons))
+
+    for e in g.classes.values():
+        parents = [g.canonicalize(n) for n, _ in e.parents]
+        assert(len(parents) == len(set(parents)))
+
+def test_guards_and_appliers():
+    x = PatternVariable("x")
+    g = EGraph()
+    leaf = g.add_term(Term("a", tuple()))
+    a = g.add(ENode("f", (leaf,)))
+    b = g.add_term(Term("f", (Term("b", tuple()),)))
+    g.rebuild()
+
+    # The guard rejects f(b) before its right-hand side is added
+    only_a = Rule(
+        PatternTerm("f", [x]),
+        PatternTerm("g", [x]),
+        guard=lambda s, g: g.find(s["x"]) == g.find(leaf)
+    )
+    k = g.count_nodes()
+    report = g.apply([(only_a, s, c) for (s, c) in g.ematch(only_a.left)])
+    assert(report.rejected == 1 and report.unions == 1)
+    assert(g.count_nodes() == k + 1)
+
+    # An applier returns the e-class to union with
+    to_b = Rule(PatternTerm("f", [x]), applier=lambda s, g: b)
+    g.run([to_b], scheduler=SimpleScheduler())
+    assert(g.find(a) == g.find(b))
+
+def test_plan_visits_rare_subterms_first():
+    x = PatternVariable("x")
+    r = Rule(PatternTerm("f", [PatternTerm("g", [x]), PatternTerm("h", [x])]), x)
+    g = EGraph()
+    for i in range(8):
+        a = g.add_term(Term(f"a{i}", tuple()))
+        g.add(ENode("f", (g.add(ENode("g", (a,))), g.add(ENode("g", (g.add(ENode("g", (a,))),))))))
+    y = Term("y", tuple())
+    g.add_term(Term("f", (Term("g", (y,)), Term("h", (y,)))))
+    g.rebuild()
+
+    assert(g.plan(r).explain() == "\n".join([
+        "bind $0 to f($1, $2)",
+        "bind $2 to h($3)",
+        "bind $1 to g($4)",
+        "compare $3 = $4",
+        "yield x = $3",
+    ]))
+    assert(g.ematch(r.left, g.plan(r)) == g.ematch(r.left, r.program))
+    assert(len(g.ematch(r.left, g.plan(r))) == 1)
+
+    # Planned again only once the counts change enough
+    q = g.plan(r)
+    g.add(ENode("g", (g.add_term(Term("b", tuple())),)))
+    assert(g.plan(r) is q)
+    for i in range(8):
+        g.add(ENode("h", (g.add_term(Term(f"c{i}", tuple())),)))
+    assert(g.plan(r) is not q)
+
+def test_ground_subterms():
+    from herbie_rules import add_identity_right, zero
+
+    g = EGraph()
+    a = g.add_term(Term("+", (Term("x", tuple()), Term("1", tuple()))))
+    g.rebuild()
+    q = add_identity_right.program
+    assert(q.explain().splitlines()[1] == "compare $2 = 0")
+    # No 0 in the e-graph, so nothing is even looked at
+    assert(g.resolve(q) is None)
+    assert(g.ematch(add_identity_right.left, q) == [])
+
+    b = g.add_term(Term("+", (Term("x", tuple()), Term("0", tuple()))))
+    g.rebuild()
+    assert(g.ematch(add_identity_right.left, q) == [((g.add_term(Term("x", tuple())),), b)])
+    # A pattern with no variables at all only matches at its own e-class
+    assert(g.ematch(zero) == [((), g.add_term(Term("0", tuple())))])
+
+def test_ac_operators():
+    from herbie_rules import ac, add_identity_right, add_inverse_left
+    a, b, c = (Term(f, tuple()) for f in "abc")
+    def add(*ts):
+        return Term("+", ts)
+
+    g = EGraph(ac=ac)
+    # Nested sums are one node, with the operands in a canonical order
+    s = g.add_term(add(a, add(Term("negate", (b,)), add(c, b))))
+    assert(g.add_term(add(add(b, c), add(a, Term("negate", (b,))))) == s)
+    g.rebuild()
+    assert(len(g.operator_nodes["+"]) == 1)
+
+    # -b + b is found inside the longer sum, and x + 0 leaves the rest
+    # of the sum for x
+    explain = g.plan(add_inverse_left).explain().splitlines()
+    assert(explain[0] == "bind $0 to +($1, $2) in any order, the rest in $2, or some of it")
+    g.run([add_inverse_left, add_identity_right])
+    assert(g.find(s) == g.find(g.add_term(add(c, a))))
+
+def test_commutative_operators():
+    from herbie_rules import add_identity_right
+    a, b, c, zero = (Term(f, tuple()) for f in ["a", "b", "c", "0"])
+    g = EGraph(commutative=("+",))
+    s = g.add_term(Term("+", (a, b)))
+    assert(g.add_term(Term("+", (b, a))) == s)
+
+    # x + 0 matches 0 + a
+    t = g.add_term(Term("+", (zero, a)))
+    g.rebuild()
+    assert(g.ematch(add_identity_right.left) == [((g.add_term(a),), t)])
+
+    # A union can reorder the operands, which are sorted again
+    u = g.add_term(Term("+", (c, a)))
+    g.union(g.add_term(zero), g.add_term(c))
+    g.rebuild()
+    assert(g.find(t) == g.find(u))
+    assert(all(list(n.operands) == sorted(n.operands) for n in g.operator_nodes["+"]))
+
+def test_rules_for_missing_operators_are_skipped():
+    from herbie_rules import negate_involutive, subtract_definition
+    from runner import Runner
+
+    g = EGraph()
+    g.add_term(Term("-", (Term("a", tuple()), Term("b", tuple()))))
+    g.rebuild()
+    assert(not g.relevant(negate_involutive))
+    # The reversed definition of subtraction adds the first negate
+    report = Runner(g, [negate_involutive, reverse(subtract_definition), subtract_definition]).run()
+    assert(report.history[0].skipped == [negate_involutive, subtract_definition])
+    assert(report.history[1].skipped == [])
@@ -0,0 +1,78 @@
+from egraph import *
+from extract import *
+
+x = Term("x", tuple())
+zero = Term("0", tuple())
+
+def test_extract_smallest():
+    g = EGraph()
+    a = g.add_term(Term("+", (x, zero)))
+    b = g.add_term(Term("*", (Term("+", (x, zero)), Term("1", tuple()))))
+    g.union(a, g.add_term(x))
+    g.union(a, b)
+    g.rebuild()
+
+    assert(Extractor(g).find_best(b) == (1, x))
+    weights = operator_weights({ "x": 10 })
+    assert(Extractor(g, weights).find_best(b) == (10, x))
+
+def test_extract_size_and_depth_disagree():
+    # f(x, x, x, x) is bigger but shallower than g(g(x))
+    g = EGraph()
+    a = g.add_term(Term("f", (x, x, x, x)))
+    b = g.add_term(Term("g", (Term("g", (x,)),)))
+    g.union(a, b)
+    g.rebuild()
+
+    assert(Extractor(g, ast_size).find_best(a) == (3, Term("g", (Term("g", (x,)),))))
+    assert(Extractor(g, ast_depth).find_best(a) == (2, Term("f", (x, x, x, x))))
+
+def test_extract_cycles():
+    # a = f(a) = x, so the e-class of f(a) loops back on itself
+    g = EGraph()
+    a = g.add_term(x)
+    g.union(a, g.add(ENode("f", (a,))))
+    b = g.add(ENode("g", (a,)))
+    g.rebuild()
+
+    e = Extractor(g)
+    assert(e.find_best(a) == (1, x))
+    assert(e.find_best(b) == (2, Term("g", (x,))))
+
+def test_dag_extraction_shares_subterms():
+    s = Term("sin", (x,))
+    c = Term("cos", (x,))
+    t = Term("tan", (x,))
+    weights = operator_weights({ "sin": 3, "tan": 3, "cos": 5 })
+
+    # As a tree h(s, s) pays for s twice, so h2(c) is cheaper, but as
+    # a DAG s is only paid for once
+    g = EGraph()
+    a = g.add_term(Term("h", (s, s)))
+    g.union(a, g.add_term(Term("h2", (c,))))
+    g.rebuild()
+
+    assert(Extractor(g, weights).find_best(a) == (7, Term("h2", (c,))))
+    e = DagExtractor(g, [a], weights)
+    dag = e.dag()
+    assert(e.total_cost() == 5)
+    assert(len(dag.nodes) == 3)
+    assert(dag.term(dag.roots[0]) == Term("h", (s, s)))
+
+    # Each root on its own is cheapest without c, but c shared by both
+    # is cheaper than s and t. Greedy doesn't see that, branch-and-bound
+    # does.
+    g = EGraph()
+    a = g.add_term(Term("p", (s,)))
+    b = g.add_term(Term("q", (t,)))
+    g.union(a, g.add_term(Term("f", (c,))))
+    g.union(b, g.add_term(Term("g", (c,))))
+    g.rebuild()
+
+    assert(DagExtractor(g, [a, b], weights).total_cost() == 9)
+    e = DagExtractor(g, [a, b], weights, exact=True)
+    assert(e.optimal)
+    assert(e.total_cost() == 8)
+    dag = e.dag()
+    assert([dag.term(i) for i in dag.roots] == [Term("f", (c,)), Term("g", (c,))])
+    assert(len(dag.nodes) == 4)
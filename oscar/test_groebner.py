@@ -0,0 +1,25 @@
+from groebner import GroebnerBasis
+from random import Random
+from sympy import symbols, groebner, reduced
+
+def test_incremental_basis_matches_groebner():
+    random = Random(0)
+    e = symbols("e0:8")
+    for _ in range(10):
+        b = GroebnerBasis()
+        ps = list()
+        k = 0
+        # Add generators and equations a few at a time, the way the
+        # e-graph does, and compare with computing the basis again
+        for _ in range(4):
+            b.add_generators(e[k:k + 2])
+            k += 2
+            x, y, z = (random.choice(e[:k]) for _ in range(3))
+            new = [random.choice([x - y * z, x - y - z, x * y - 1]), random.choice([x - y, x - 2])]
+            ps.extend(new)
+            b.add(new)
+
+            g = groebner(ps, *e[:k])
+            assert(len(b.polys) == len(g.exprs))
+            for a in e[:k]:
+                assert(b.reduce(a) == reduced(a, list(g.exprs), *e[:k])[1])
@@ -1,4 +1,4 @@
-from union_find import UnionFind
+from union_find import UnionFind, ArrayUnionFind
 
 def test_union_find():
     n = 10
@@ -24,3 +24,38 @@ def test_union_find():
     # indices:  0  1  2  3  4  5, 6, 7, 8, 9
     expected = [0, 0, 0, 0, 4, 5, 6, 6, 6, 6]
     assert(u.parents == expected)
+
+def check_array_union_find():
+    n = 10
+    u = ArrayUnionFind()
+
+    for _ in range(n):
+        u.add()
+
+    assert(list(u.parents) == list(range(n)))
+
+    # The bigger class keeps its root, whichever side it's on
+    assert(u.union(0, 1) == 0)
+    assert(u.union(2, 0) == 0)
+    assert(u.union(3, 0) == 0)
+    assert(u.union(6, 7) == 6)
+    assert(u.union(8, 9) == 8)
+    # Ties go to the first argument
+    assert(u.union(7, 8) == 6)
+    assert(u.union(5, 6) == 6)
+    assert(u.union(0, 9) == 6)
+
+    assert(u.size(1) == 9)
+    assert(u.size(4) == 1)
+    assert(u.find_many([1, 4, 7, 5]) == [6, 4, 6, 6])
+
+    u.canonicalize_all()
+    assert(list(u.parents) == [6, 6, 6, 6, 4, 6, 6, 6, 6, 6])
+
+def test_array_union_find():
+    check_array_union_find()
+
+def test_array_union_find_without_numpy(monkeypatch):
+    import union_find
+    monkeypatch.setattr(union_find, "numpy", None)
+    check_array_union_find()
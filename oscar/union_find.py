@@ -35,3 +35,101 @@ class UnionFind:
         return x
 
         
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class ArrayUnionFind:
+    """
+    Union find backed by `array('q')` buffers, with union by size.
+
+    `find_many` and `canonicalize_all` resolve lots of ids at once.
+    With NumPy they do it with vectorized pointer jumping over a view
+    of the parents buffer, otherwise they fall back to calling `find`.
+    """
+    def __init__(self):
+        self.parents = array('q')
+        self.sizes = array('q')
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def add(self) -> int:
+        l = len(self.parents)
+        self.parents.append(l)
+        self.sizes.append(1)
+        return l
+
+    def find(self, x: int) -> int:
+        """
+        Same path-splitting find as `UnionFind.find`.
+        """
+        parents = self.parents
+        while x != parents[x]:
+            grandparent = parents[parents[x]]
+            parents[x] = grandparent
+            x = grandparent
+        return x
+
+    def size(self, x: int) -> int:
+        """
+        The number of ids in the equivalence class of `x`.
+        """
+        return self.sizes[self.find(x)]
+
+    def union(self, x: int, y: int) -> int:
+        """
+        Union two equivalence classes, returning the new root. The root
+        of the bigger class stays the root, so unlike `UnionFind.union`
+        this isn't necessarily `x`.
+        """
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+        if self.sizes[x] < self.sizes[y]:
+            x, y = y, x
+        self.parents[y] = x
+        self.sizes[x] += self.sizes[y]
+        return x
+
+    def find_many(self, ids) -> list[int]:
+        """
+        `find` for each id in `ids`.
+        """
+        if numpy is None:
+            return [self.find(x) for x in ids]
+        # Views of the buffer must be gone before the next `add`, which
+        # might need to resize it
+        parents = numpy.frombuffer(self.parents, dtype=numpy.int64)
+        xs = numpy.asarray(ids, dtype=numpy.int64)
+        while True:
+            ys = parents[xs]
+            if numpy.array_equal(xs, ys):
+                break
+            xs = ys
+        result = xs.tolist()
+        del parents
+        return result
+
+    def canonicalize_all(self):
+        """
+        Point every id directly at its root.
+        """
+        if numpy is None:
+            for x in range(len(self.parents)):
+                self.parents[x] = self.find(x)
+            return
+        # Pointer jumping: replace every parent with its grandparent
+        # until nothing changes. With union by size the trees have
+        # logarithmic depth, so this takes O(log log n) rounds.
+        parents = numpy.frombuffer(self.parents, dtype=numpy.int64)
+        while True:
+            grandparents = parents[parents]
+            if numpy.array_equal(parents, grandparents):
+                break
+            parents[:] = grandparents
+        del parents